@@ -0,0 +1,87 @@
+import json
+import subprocess
+import logging
+from config import MAX_FILE_SIZE, MAX_VIDEO_SIZE, PROBE_TIMEOUT, PROBE_HEAD_BYTES
+
+logger = logging.getLogger(__name__)
+
+MEDIA_EXTENSIONS = {
+    'voice': 'ogg',
+    'audio': 'mp3',
+    'video': 'mp4'
+}
+
+
+class AdmissionControl:
+    """Reject oversize files and exhausted quotas before anything is downloaded"""
+
+    def __init__(self, bot, db, files, max_file_size=MAX_FILE_SIZE, max_video_size=MAX_VIDEO_SIZE):
+        self.bot = bot
+        self.db = db
+        self.files = files
+        self.max_file_size = max_file_size
+        self.max_video_size = max_video_size
+
+    def get_media_info(self, message):
+        """Collect file id, size and duration from the Telegram message"""
+        media = getattr(message, message.content_type)
+        return {
+            'content_type': message.content_type,
+            'file_id': media.file_id,
+            'file_unique_id': getattr(media, 'file_unique_id', None),
+            'file_extension': MEDIA_EXTENSIONS[message.content_type],
+            'file_size': getattr(media, 'file_size', None),
+            'duration': getattr(media, 'duration', None)
+        }
+
+    def probe_media(self, file_id):
+        """Read size and duration from the container header without downloading the file
+
+        The header is fetched in-process and piped to ffprobe, so the file URL
+        (which holds the bot token) never reaches a command line or the log.
+        """
+        info = {'file_size': None, 'duration': None}
+        try:
+            file_info = self.bot.get_file(file_id)
+            info['file_size'] = file_info.file_size
+            head = self.files.read_head(file_info.file_path, PROBE_HEAD_BYTES, timeout=PROBE_TIMEOUT)
+
+            output = subprocess.run(
+                ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', '-i', 'pipe:0'],
+                input=head,
+                capture_output=True,
+                timeout=PROBE_TIMEOUT,
+                check=True
+            ).stdout
+            duration = json.loads(output).get('format', {}).get('duration')
+            if duration:
+                info['duration'] = float(duration)
+        except subprocess.CalledProcessError as e:
+            logger.warning(f'Could not probe media {file_id}: ffprobe exited with {e.returncode}')
+        except Exception as e:
+            # Request errors carry the file URL, so only the type is logged
+            logger.warning(f'Could not probe media {file_id}: {type(e).__name__}')
+        return info
+
+    def check(self, message, user_id):
+        """Return (allowed, reason, media); reason is a language key when refused"""
+        media = self.get_media_info(message)
+
+        if not media['file_size'] or not media['duration']:
+            probed = self.probe_media(media['file_id'])
+            media['file_size'] = media['file_size'] or probed['file_size']
+            media['duration'] = media['duration'] or probed['duration']
+
+        max_size = self.max_video_size if media['content_type'] == 'video' else self.max_file_size
+        if media['file_size'] and media['file_size'] > max_size:
+            logger.info(f"Rejected {media['file_size']} byte file from user {user_id}")
+            return False, 'file_too_large', media
+
+        # Unknown duration is re-checked after decoding
+        if media['duration']:
+            can_use, _ = self.db.can_use_service(user_id, media['duration'] / 60)
+            if not can_use:
+                logger.info(f"Rejected {media['duration']}s file from user {user_id}: quota exceeded")
+                return False, 'quota_exceeded', media
+
+        return True, 'OK', media
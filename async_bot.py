@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Asyncio runtime: run `python async_bot.py` instead of `python bot.py`
+
+Telegram I/O goes through AsyncTeleBot, so one event loop holds any number
+of conversations. SQLite, ffprobe, the streamed download/decode and the
+command/settings handlers of bot.py run on a thread pool; inference runs on
+a process pool. Media jobs are not persisted or prioritized here, the
+thread runtime in bot.py keeps doing that.
+"""
+
+import os
+import json
+import asyncio
+import functools
+import logging
+import multiprocessing
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from config import *
+from diagnostics import process_memory
+from transcription import FileTooLargeError, init_offload_worker, transcribe_pcm
+
+logger = logging.getLogger(__name__)
+
+abot = AsyncTeleBot(BOT_TOKEN, parse_mode='Markdown')
+
+# Set up in main(): the spawned pool processes import this module, and must
+# not build bot.py's TeleBot, database, log handler and handlers of their own
+sync_bot = None
+db = None
+lang_manager = None
+admission = None
+transcription_service = None
+io_executor = None
+cpu_executor = None
+active_jobs = 0
+STARTED_AT = datetime.now()
+
+
+async def run_io(func, *args, **kwargs):
+    """Run blocking I/O (SQLite, ffprobe, sync handlers) on the thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_cpu(func, *args):
+    """Run ffmpeg or inference on the process pool"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, func, *args)
+
+
+async def edit_status(chat_id, message_id, text):
+    try:
+        await abot.edit_message_text(text, chat_id, message_id)
+    except ApiTelegramException as e:
+        logger.debug(f"Could not edit message {message_id}: {e}")
+
+
+async def send_quota_exceeded(chat_id, message_id, lang, quota):
+    await edit_status(
+        chat_id,
+        message_id,
+        lang_manager.get('quota_exceeded', lang, used=quota['minutes_used'], limit=quota['minutes_limit'])
+    )
+
+
+async def transcribe_media(user_id, data, model, backend):
+    """Download, decode and transcribe with a quota hold; None when the job was refused"""
+    chat_id = data['chat_id']
+    processing_msg_id = data['processing_msg_id']
+    media = data['media']
+    lang = data['lang']
+    video = media['content_type'] == 'video'
+
+    await edit_status(chat_id, processing_msg_id, lang_manager.get('downloading', lang))
+
+    # PCM goes through a file so the pool processes never pickle whole signals
+    fd, pcm_path = tempfile.mkstemp(suffix='.pcm', dir=TEMP_FOLDER)
+    os.close(fd)
+    try:
+        try:
+            # Decoded while it downloads; of a video only the audio stream is kept
+            audio, file_size, duration = await run_io(
+                transcription_service.load_streamed_audio, media['file_id'], video, pcm_path
+            )
+        except FileTooLargeError:
+            await edit_status(chat_id, processing_msg_id, lang_manager.get('file_too_large', lang))
+            return None
+        # The pool process maps the file itself
+        del audio
+        duration_minutes = duration / 60
+
+        reserved, quota = await run_io(db.reserve_quota, user_id, duration_minutes)
+        if not reserved:
+            await send_quota_exceeded(chat_id, processing_msg_id, lang, quota)
+            return None
+
+        await edit_status(chat_id, processing_msg_id, lang_manager.get('transcribing', lang))
+        try:
+            result = await run_cpu(transcribe_pcm, pcm_path, data['transcribe_lang'], data['task_type'], model, backend)
+        except Exception:
+            await run_io(db.release_quota, user_id, duration_minutes)
+            raise
+    finally:
+        transcription_service.cleanup_file(pcm_path)
+
+    quota = await run_io(db.commit_quota, user_id, duration_minutes)
+    result['duration'] = duration
+
+    if media.get('file_unique_id'):
+        await run_io(
+            db.cache_transcript, media['file_unique_id'], f'{backend}/{model}', data['task_type'],
+            data['transcribe_lang'], result
+        )
+
+    return result, file_size, duration_minutes, quota
+
+
+async def process_media(user_id, data):
+    """Transcribe (or fetch from cache) and deliver one media message"""
+    chat_id = data['chat_id']
+    processing_msg_id = data['processing_msg_id']
+    media = data['media']
+    lang = data['lang']
+    transcribe_lang = data['transcribe_lang']
+    task_type = data['task_type']
+
+    quota = await run_io(db.get_user_quota, user_id)
+    plan_config = PLAN_CONFIG[quota['plan_type']]
+    model = plan_config['model']
+    backend = plan_config['backend']
+
+    result = None
+    if media.get('file_unique_id'):
+        result = await run_io(
+            db.get_cached_transcript, media['file_unique_id'], f'{backend}/{model}', task_type, transcribe_lang
+        )
+
+    if result:
+        result['processing_time'] = 0.0
+        file_size = media['file_size'] or 0
+        duration_minutes = result['duration'] / 60 if BILL_CACHE_HITS else 0
+        if duration_minutes:
+            reserved, quota = await run_io(db.reserve_quota, user_id, duration_minutes)
+            if not reserved:
+                await send_quota_exceeded(chat_id, processing_msg_id, lang, quota)
+                return
+            quota = await run_io(db.commit_quota, user_id, duration_minutes)
+        logger.info(f"Served cached transcript of {media['file_unique_id']} to user {user_id}")
+    else:
+        transcribed = await transcribe_media(user_id, data, model, backend)
+        if not transcribed:
+            return
+        result, file_size, duration_minutes, quota = transcribed
+
+    await run_io(
+        db.add_usage_stat,
+        user_id,
+        file_type=data['content_type'],
+        file_size=file_size,
+        duration_seconds=result['duration'],
+        processing_time=result['processing_time'],
+        language=result['language'],
+        task_type=task_type,
+        characters_count=len(result['text']),
+        words_count=len(result['text'].split())
+    )
+
+    result_text = sync_bot.format_result(result, task_type, lang, duration_minutes, quota)
+
+    # The processing message becomes the result
+    if len(result_text) <= 4000:
+        await abot.edit_message_text(result_text, chat_id, processing_msg_id)
+    else:
+        await edit_status(chat_id, processing_msg_id, lang_manager.get('transcription_complete', lang))
+        txt_file = transcription_service.export_as_txt(result['text'])
+        try:
+            with open(txt_file, 'rb') as f:
+                await abot.send_document(chat_id, f, caption=lang_manager.get('transcription_complete', lang))
+        finally:
+            transcription_service.cleanup_file(txt_file)
+
+    logger.info(f"Transcription completed for user {user_id}")
+
+
+async def handle_media(message):
+    """Handle media files"""
+    global active_jobs
+    user_id = message.from_user.id
+    settings = await run_io(db.get_user_settings, user_id)
+    lang = settings.get('interface_lang', 'ar')
+
+    try:
+        allowed, reason, media = await run_io(admission.check, message, user_id)
+        if not allowed:
+            if reason == 'quota_exceeded':
+                quota = await run_io(db.get_user_quota, user_id) or {'minutes_used': 0, 'minutes_limit': 0}
+                text = lang_manager.get(reason, lang, used=quota['minutes_used'], limit=quota['minutes_limit'])
+            else:
+                text = lang_manager.get(reason, lang)
+            await abot.send_message(message.chat.id, text, reply_to_message_id=message.message_id)
+            return
+
+        if active_jobs >= ASYNC_MAX_JOBS:
+            await abot.send_message(message.chat.id, lang_manager.get('queue_full', lang))
+            return
+
+        processing_msg = await abot.send_message(message.chat.id, lang_manager.get('processing', lang))
+
+        active_jobs += 1
+        try:
+            await process_media(user_id, {
+                'chat_id': message.chat.id,
+                'message_id': message.message_id,
+                'processing_msg_id': processing_msg.message_id,
+                'content_type': message.content_type,
+                'media': media,
+                'lang': lang,
+                'transcribe_lang': settings['transcribe_lang'],
+                'task_type': settings['task_type']
+            })
+        finally:
+            active_jobs -= 1
+
+    except Exception as e:
+        logger.error(f"Error handling media: {e}")
+        await abot.send_message(
+            message.chat.id,
+            lang_manager.get('error_occurred', lang, error=str(e))
+        )
+
+
+async def status_command(message):
+    """Job, pool, cache and memory state of this process"""
+    state = {
+        'uptime': str(datetime.now() - STARTED_AT).split('.')[0],
+        'memory_mb': process_memory(),
+        'jobs': {'active': active_jobs, 'max': ASYNC_MAX_JOBS},
+        'pools': {'processes': ASYNC_PROCESSES, 'io_threads': ASYNC_IO_THREADS},
+        'db_caches': await run_io(db.get_cache_stats)
+    }
+    await abot.send_message(message.chat.id, f'```\n{json.dumps(state, indent=1, default=str)}\n```')
+
+
+async def profile_command(message):
+    # Profiling wraps the worker threads of bot.py's JobQueue, which this runtime does not use
+    await abot.send_message(message.chat.id, 'Profiling is only available in the thread runtime (bot.py)')
+
+
+class LoopBot:
+    """Blocking stand-in for bot.py's TeleBot while its handlers run on the thread pool
+
+    Each AsyncTeleBot call is run on the event loop and waited for, so those
+    handlers' Telegram I/O shares the loop's session and never blocks it.
+    """
+
+    def __init__(self, abot, loop):
+        self.abot = abot
+        self.loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self.abot, name)
+        if not asyncio.iscoroutinefunction(method):
+            return method
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(method(*args, **kwargs), self.loop).result()
+        return call
+
+
+def _offloaded(function):
+    async def handler(update):
+        try:
+            await run_io(function, update)
+        except Exception as e:
+            logger.error(f"Error in {function.__name__}: {e}")
+    handler.__name__ = function.__name__
+    return handler
+
+
+def register_handlers():
+    """Register the native handlers, then bot.py's remaining ones in order and with the same filters
+
+    The media, /status and /profile handlers of bot.py feed or report its JobQueue,
+    so they are replaced; the rest run on the thread pool.
+    """
+    abot.register_message_handler(handle_media, content_types=['voice', 'audio', 'video'])
+    abot.register_message_handler(status_command, commands=['status'], func=sync_bot.is_admin)
+    abot.register_message_handler(profile_command, commands=['profile'], func=sync_bot.is_admin)
+
+    replaced = (sync_bot.handle_media, sync_bot.status_command, sync_bot.profile_command)
+    for handler in sync_bot.bot.message_handlers:
+        if handler['function'] not in replaced:
+            abot.register_message_handler(_offloaded(handler['function']), **handler['filters'])
+    for handler in sync_bot.bot.callback_query_handlers:
+        abot.register_callback_query_handler(_offloaded(handler['function']), **handler['filters'])
+
+
+def load_shared(loop):
+    """Import bot.py for its database, services and handlers, and route its Telegram calls through abot"""
+    global sync_bot, db, lang_manager, admission, transcription_service
+    import bot as sync_bot
+    sync_bot.setup()
+    db = sync_bot.db
+    lang_manager = sync_bot.lang_manager
+    admission = sync_bot.admission
+    transcription_service = sync_bot.transcription_service
+
+    register_handlers()
+    # The handlers look the name up at call time
+    sync_bot.bot = LoopBot(abot, loop)
+
+
+async def main():
+    """Main function"""
+    global io_executor, cpu_executor
+
+    load_shared(asyncio.get_running_loop())
+
+    threads = max(1, (os.cpu_count() or 1) // ASYNC_PROCESSES)
+    io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix='async-io')
+    cpu_executor = ProcessPoolExecutor(
+        max_workers=ASYNC_PROCESSES,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_offload_worker,
+        initargs=(threads, WARMUP_ENABLED)
+    )
+
+    logger.info("Async bot started successfully!")
+    logger.info(f"Bot username: @{BOT_USERNAME}")
+
+    try:
+        await run_io(db.clear_quota_reservations)
+        await abot.remove_webhook()
+        await abot.infinity_polling(timeout=60, request_timeout=90)
+    finally:
+        await abot.close_session()
+        cpu_executor.shutdown(cancel_futures=True)
+        io_executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+import os
+import mmap
+import tempfile
+import threading
+import subprocess
+import logging
+import numpy as np
+from config import TEMP_FOLDER, DECODE_BLOCK_SECONDS
+from backends import SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+
+AUDIO_ONLY_OPTIONS = ['-vn', '-sn', '-dn']
+
+
+def _pcm_command(source, sample_rate, max_seconds=None, audio_only=False):
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-threads', '0', '-i', source]
+    if audio_only:
+        cmd += AUDIO_ONLY_OPTIONS
+    if max_seconds:
+        cmd += ['-t', str(max_seconds)]
+    return cmd + ['-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(sample_rate), '-']
+
+
+def _feed(process, chunks, failure):
+    """Write downloaded chunks to ffmpeg's stdin until they run out or ffmpeg stops reading"""
+    try:
+        for chunk in chunks:
+            try:
+                process.stdin.write(chunk)
+            except BrokenPipeError:
+                # ffmpeg exited early, e.g. once -t was reached; the rest of the download is not needed
+                break
+    except Exception as e:
+        failure.append(e)
+        process.kill()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _run_ffmpeg(cmd, out, sample_rate, chunks=None):
+    """Run ffmpeg and write its output to out as float32 PCM, one block at a time"""
+    block_bytes = int(DECODE_BLOCK_SECONDS * sample_rate) * 2
+    failure = []
+
+    with tempfile.TemporaryFile() as errors:
+        # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+        with subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if chunks is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=errors
+        ) as process:
+            feeder = None
+            if chunks is not None:
+                feeder = threading.Thread(target=_feed, args=(process, chunks, failure), daemon=True)
+                feeder.start()
+
+            while True:
+                block = process.stdout.read(block_bytes)
+                if not block:
+                    break
+                samples = np.frombuffer(block[:len(block) // 2 * 2], dtype=np.int16)
+                out.write((samples.astype(np.float32) / 32768.0).tobytes())
+
+            if feeder:
+                feeder.join()
+
+        if failure:
+            raise failure[0]
+        if process.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f'Failed to load audio: {errors.read().decode(errors="replace").strip()}')
+
+
+def _decode(cmd, sample_rate, chunks=None, pcm_path=None):
+    """Decode into pcm_path, or an unlinked temp file, and map it
+
+    The full signal never has to fit in process memory; the mapping keeps an
+    unlinked file alive until the array is freed. A given pcm_path is left in
+    place for the caller to remove.
+    """
+    keep = pcm_path is not None
+    if not keep:
+        fd, pcm_path = tempfile.mkstemp(suffix='.pcm', dir=TEMP_FOLDER)
+        os.close(fd)
+    try:
+        with open(pcm_path, 'wb') as out:
+            _run_ffmpeg(cmd, out, sample_rate, chunks)
+        return open_pcm(pcm_path)
+    finally:
+        if not keep:
+            os.unlink(pcm_path)
+
+
+def open_pcm(pcm_path):
+    """Map a float32 PCM file as an array"""
+    if os.path.getsize(pcm_path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    # Copy-on-write keeps the array writable (torch warns otherwise) without touching the file
+    return np.memmap(pcm_path, dtype=np.float32, mode='c')
+
+
+def decode_audio(file_path, sample_rate=SAMPLE_RATE, max_seconds=None, audio_only=False, pcm_path=None):
+    """Decode a file to mono float32 PCM backed by a memory-mapped file"""
+    return _decode(_pcm_command(file_path, sample_rate, max_seconds, audio_only), sample_rate, pcm_path=pcm_path)
+
+
+def decode_stream(chunks, sample_rate=SAMPLE_RATE, max_seconds=None, audio_only=False, pcm_path=None):
+    """Decode a container piped in chunk by chunk as it downloads; nothing but PCM is stored"""
+    return _decode(_pcm_command('pipe:0', sample_rate, max_seconds, audio_only), sample_rate, chunks, pcm_path)
+
+
+def moov_first(head):
+    """True when an MP4 header shows the moov index ahead of the media data
+
+    Files with the index at the end cannot be demuxed from a pipe because
+    ffmpeg has to seek for it. An MP4 whose header ends before either box
+    shows up counts as not streamable; anything that does not look like MP4
+    counts as streamable.
+    """
+    mp4 = head[4:8] == b'ftyp'
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box = head[offset + 4:offset + 8]
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            break
+        offset += size
+    return not mp4
+
+
+def release_pages(audio, start, end):
+    """Drop the resident pages behind audio[start:end] once that window has been consumed"""
+    buffer = getattr(audio, '_mmap', None)
+    if buffer is None or audio.base is not buffer or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+
+    first = -(-start * audio.itemsize // mmap.PAGESIZE) * mmap.PAGESIZE
+    last = end * audio.itemsize // mmap.PAGESIZE * mmap.PAGESIZE
+    if last > first:
+        try:
+            buffer.madvise(mmap.MADV_DONTNEED, first, last - first)
+        except OSError as e:
+            logger.debug(f"madvise failed: {e}")
@@ -0,0 +1,192 @@
+import os
+import logging
+from config import CT2_COMPUTE_TYPE
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+class InferenceBackend:
+    """Interface implemented by every inference engine
+
+    Models returned by load() are opaque handles that are only passed back to
+    the same backend, so the model cache can hold models of any engine.
+    """
+
+    name = None
+
+    def load(self, model_name):
+        raise NotImplementedError
+
+    def transcribe(self, model, audio, **options):
+        """Whisper-style result dict: text, language, segments"""
+        raise NotImplementedError
+
+    def detect_language(self, model, audio):
+        """Language code spoken in the first 30 seconds"""
+        raise NotImplementedError
+
+    def decode_batch(self, model, clips, task, language):
+        """Results for several clips of at most 30 seconds; only when capabilities()['batching']"""
+        raise NotImplementedError
+
+    def capabilities(self):
+        return {
+            'batching': False,
+            'initial_prompt': False,
+            'quantized': False,
+            'devices': ['cpu']
+        }
+
+
+class WhisperBackend(InferenceBackend):
+    """openai-whisper in PyTorch (fp32 on CPU, fp16 on CUDA)"""
+
+    name = 'whisper'
+
+    def load(self, model_name):
+        import whisper
+        return whisper.load_model(model_name)
+
+    def transcribe(self, model, audio, **options):
+        options.setdefault('fp16', model.device.type == 'cuda')
+        return model.transcribe(audio, **options)
+
+    def detect_language(self, model, audio):
+        import whisper
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels).to(model.device)
+        _, probs = model.detect_language(mel)
+        return max(probs, key=probs.get)
+
+    def decode_batch(self, model, clips, task, language):
+        import torch
+        import whisper
+
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(clip), model.dims.n_mels) for clip in clips
+        ]).to(model.device)
+
+        options = whisper.DecodingOptions(
+            task=task,
+            language=None if language == 'auto' else language,
+            without_timestamps=True,
+            fp16=model.device.type == 'cuda'
+        )
+
+        results = []
+        for clip, result in zip(clips, whisper.decode(model, mel, options)):
+            # Same silence rule as whisper's transcribe()
+            text = result.text.strip()
+            if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0:
+                text = ''
+            duration = len(clip) / SAMPLE_RATE
+            results.append({
+                'text': text,
+                'language': result.language,
+                'segments': [{'id': 0, 'start': 0.0, 'end': duration, 'text': text}] if text else []
+            })
+        return results
+
+    def capabilities(self):
+        return {
+            'batching': True,
+            'initial_prompt': True,
+            'quantized': False,
+            'devices': ['cpu', 'cuda']
+        }
+
+
+class QuantizedWhisperBackend(WhisperBackend):
+    """openai-whisper on CPU with int8 dynamic quantization of every linear layer"""
+
+    name = 'whisper-int8'
+
+    def load(self, model_name):
+        import torch
+        import whisper
+
+        model = whisper.load_model(model_name, device='cpu')
+        # whisper.model.Linear only adds a dtype cast that is a no-op in fp32, and
+        # quantize_dynamic only converts modules whose type is exactly nn.Linear
+        for module in model.modules():
+            if isinstance(module, whisper.model.Linear):
+                module.__class__ = torch.nn.Linear
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def capabilities(self):
+        return {
+            'batching': True,
+            'initial_prompt': True,
+            'quantized': True,
+            'devices': ['cpu']
+        }
+
+
+class MappedWhisperBackend(WhisperBackend):
+    """openai-whisper on CPU with fp32 weights memory-mapped from the model store"""
+
+    name = 'whisper-mmap'
+
+    def load(self, model_name):
+        from model_store import load_mmap_model
+        return load_mmap_model(model_name)
+
+    def capabilities(self):
+        return {
+            'batching': True,
+            'initial_prompt': True,
+            'quantized': False,
+            'devices': ['cpu']
+        }
+
+
+class CTranslate2Backend(InferenceBackend):
+    """CTranslate2 engine through faster-whisper (optional dependency), int8 on CPU"""
+
+    name = 'ctranslate2'
+
+    def load(self, model_name):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError('The ctranslate2 backend needs the faster-whisper package')
+        return WhisperModel(model_name, device='cpu', compute_type=CT2_COMPUTE_TYPE,
+                            cpu_threads=os.cpu_count() or 1)
+
+    def transcribe(self, model, audio, task='transcribe', language=None, initial_prompt=None, **options):
+        segments, info = model.transcribe(audio, task=task, language=language, initial_prompt=initial_prompt)
+        segments = [
+            {'id': index, 'start': segment.start, 'end': segment.end, 'text': segment.text}
+            for index, segment in enumerate(segments)
+        ]
+        return {
+            'text': ''.join(segment['text'] for segment in segments),
+            'language': info.language,
+            'segments': segments
+        }
+
+    def detect_language(self, model, audio):
+        # Segments are decoded lazily; only language detection runs here
+        _, info = model.transcribe(audio[:30 * SAMPLE_RATE])
+        return info.language
+
+    def capabilities(self):
+        return {
+            'batching': False,
+            'initial_prompt': True,
+            'quantized': CT2_COMPUTE_TYPE.startswith('int8'),
+            'devices': ['cpu']
+        }
+
+
+BACKENDS = {backend.name: backend for backend in (
+    WhisperBackend(), QuantizedWhisperBackend(), MappedWhisperBackend(), CTranslate2Backend()
+)}
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,119 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from config import BATCH_MAX_SIZE, BATCH_MAX_WAIT, DEFAULT_BACKEND, TRANSCRIPTION_WORKERS
+from backends import get_backend
+from model_cache import model_cache
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.closed = threading.Event()
+
+
+class MicroBatcher:
+    """Decodes short clips that share model, task and language as one padded mel batch
+
+    The first caller for a key becomes the batch leader: it waits up to
+    max_wait seconds (or until max_batch_size clips arrived), runs the batch
+    and hands each waiting caller its own result. The leader runs at once
+    when no other clip can join: its clip is the only one in flight, or every
+    one of the max_callers threads that transcribe is already in flight.
+    """
+
+    def __init__(self, max_batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT, max_callers=TRANSCRIPTION_WORKERS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_callers = max_callers
+        self._open = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'batches': 0,
+            'clips': 0,
+            'largest_batch': 0
+        }
+
+    def transcribe(self, audio, model_name, language='auto', task='transcribe', backend=DEFAULT_BACKEND):
+        """Transcribe one clip of at most 30 seconds, possibly together with others"""
+        key = (model_name, backend, task, language)
+        future = Future()
+
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.items.append((audio, future))
+            self._in_flight += 1
+            # Waiting only pays off under load, and only while some caller is still free to join
+            joinable = 1 < self._in_flight < self.max_callers
+            if len(batch.items) >= self.max_batch_size or self._in_flight >= self.max_callers:
+                del self._open[key]
+                batch.closed.set()
+
+        try:
+            if leader:
+                if joinable:
+                    batch.closed.wait(self.max_wait)
+                with self._lock:
+                    if self._open.get(key) is batch:
+                        del self._open[key]
+                self._run(key, batch.items)
+
+            return future.result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def can_batch(self):
+        """Whether a second clip can ever join a waiting leader
+
+        The leader waits only while fewer than max_callers clips are in
+        flight, so at least three callers are needed; with fewer every batch
+        would hold one clip and only lose decode quality.
+        """
+        return self.max_batch_size > 1 and self.max_callers > 2
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['average_batch'] = stats['clips'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def _run(self, key, items):
+        try:
+            results = self._decode(*key, [audio for audio, _ in items])
+        except Exception as e:
+            logger.error(f"Batch of {len(items)} clips failed: {e}")
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['clips'] += len(items)
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(items))
+
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+
+    def _decode(self, model_name, backend, task, language, clips):
+        start_time = time.time()
+        model = model_cache.get(model_name, backend)
+        if len(clips) == 1:
+            # A batch of one gets the full decode: temperature fallback and per-segment timestamps
+            options = {'task': task, 'verbose': False}
+            if language != 'auto':
+                options['language'] = language
+            return [get_backend(backend).transcribe(model, clips[0], **options)]
+        results = get_backend(backend).decode_batch(model, clips, task, language)
+        logger.debug(f"Decoded batch of {len(clips)} clips in {time.time() - start_time:.2f}s")
+        return results
+
+
+batcher = MicroBatcher()
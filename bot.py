@@ -3,10 +3,12 @@
 
 import os
 import sys
+import json
 import logging
 from datetime import datetime
 
 from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
 from telebot.types import Message, CallbackQuery
 
 from config import *
@@ -14,26 +16,36 @@ from database import Database
 from language_manager import LanguageManager
 from payments import PaymentHandler
 from ui_components import UIComponents
-from transcription import TranscriptionService
-
-# Setup Logging
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+from transcription import TranscriptionService, FileTooLargeError
+from admission import AdmissionControl
+from job_queue import JobQueue, QueueFullError
+from progress import ProgressReporter
+from warmup import run_warmup
+from webhook import WebhookServer
+from rate_limiter import RateLimitedBot
+from metrics import (
+    registry, start_metrics_server, start_log_summaries,
+    STAGE_SECONDS, QUEUE_WAIT_SECONDS, REAL_TIME_FACTOR, AUDIO_SECONDS, JOBS
 )
+from model_cache import model_cache
+from batching import batcher
+from diagnostics import JobProfiler, process_memory
+
 logger = logging.getLogger(__name__)
 
-# Initialize components
-bot = TeleBot(BOT_TOKEN, parse_mode='Markdown')
-db = Database(DATABASE_NAME)
-lang_manager = LanguageManager()
-payments = PaymentHandler(bot, db)
-ui = UIComponents()
-transcription_service = TranscriptionService(bot)
+# Outgoing calls are paced per chat and globally; see rate_limiter.py
+bot = RateLimitedBot(TeleBot(BOT_TOKEN, parse_mode='Markdown'))
+
+# Created by setup(): spawned pool processes re-import this module and must not
+# open the database or add log handlers of their own
+db = None
+lang_manager = None
+payments = None
+ui = None
+transcription_service = None
+admission = None
+profiler = None
+job_queue = None
 
 
 # ================== Command Handlers ==================
@@ -221,6 +233,63 @@ def handle_transcribe_lang(call: CallbackQuery):
     bot.delete_message(call.message.chat.id, call.message.message_id)
 
 
+# ================== Admin Handlers ==================
+
+STARTED_AT = datetime.now()
+
+
+def is_admin(message):
+    return message.from_user.id in ADMIN_IDS
+
+
+@bot.message_handler(commands=['profile'], func=is_admin)
+def profile_command(message: Message):
+    """/profile [jobs] [top] profiles the next media jobs; /profile off cancels"""
+    args = message.text.split()[1:]
+    if args and args[0] == 'off':
+        cancelled = profiler.disarm()
+        bot.send_message(message.chat.id, 'Profiling cancelled' if cancelled else 'Profiling was not active')
+        return
+    
+    try:
+        count = int(args[0]) if args else 5
+        top = int(args[1]) if len(args) > 1 else 30
+    except ValueError:
+        bot.send_message(message.chat.id, 'Usage: /profile [jobs] [top] or /profile off')
+        return
+    
+    profiler.arm(count, message.chat.id, top)
+    logger.info(f"Admin {message.from_user.id} started profiling the next {count} jobs")
+    bot.send_message(message.chat.id, f'Profiling the next {count} media jobs, top {top} functions')
+
+
+@bot.message_handler(commands=['status'], func=is_admin)
+def status_command(message: Message):
+    """Queue, worker, cache and memory state of this process"""
+    state = {
+        'uptime': str(datetime.now() - STARTED_AT).split('.')[0],
+        'memory_mb': process_memory(),
+        'queue': job_queue.get_stats(),
+        'running_jobs': job_queue.running_jobs(),
+        'model_cache': model_cache.get_stats(),
+        'batching': batcher.get_stats(),
+        'rate_limiter': bot.get_stats(),
+        'db_caches': db.get_cache_stats(),
+        'profiler': profiler.status()
+    }
+    text = json.dumps(state, indent=1, default=str)
+    
+    if len(text) <= 4000:
+        bot.send_message(message.chat.id, f'```\n{text}\n```')
+    else:
+        status_file = transcription_service.export_as_txt(text)
+        try:
+            with open(status_file, 'rb') as f:
+                bot.send_document(message.chat.id, f, visible_file_name='status.json')
+        finally:
+            transcription_service.cleanup_file(status_file)
+
+
 # ================== Media Handlers ==================
 
 @bot.message_handler(content_types=['voice', 'audio', 'video'])
@@ -231,127 +300,350 @@ def handle_media(message: Message):
     lang = settings.get('interface_lang', 'ar')
     
     try:
-        if message.content_type == 'voice':
-            file_id = message.voice.file_id
-            file_extension = 'ogg'
-        elif message.content_type == 'audio':
-            file_id = message.audio.file_id
-            file_extension = 'mp3'
-        elif message.content_type == 'video':
-            file_id = message.video.file_id
-            file_extension = 'mp4'
-        
-        processing_msg = bot.send_message(
-            message.chat.id,
-            lang_manager.get('processing', lang)
-        )
+        # A user without a quota row yet (no /start) gets admission's refusal, not an error
+        plan = (db.get_user_quota(user_id) or {}).get('plan_type', 'free')
+        labels = {'plan': plan, 'content_type': message.content_type}
         
-        file_path, file_size = transcription_service.download_file(file_id, file_extension)
+        with STAGE_SECONDS.time(stage='admission', **labels):
+            allowed, reason, media = admission.check(message, user_id)
+        if not allowed:
+            JOBS.inc(outcome=reason, **labels)
+            if reason == 'quota_exceeded':
+                quota = db.get_user_quota(user_id) or {'minutes_used': 0, 'minutes_limit': 0}
+                text = lang_manager.get(reason, lang, used=quota['minutes_used'], limit=quota['minutes_limit'])
+            else:
+                text = lang_manager.get(reason, lang)
+            bot.send_message(message.chat.id, text, reply_to_message_id=message.message_id)
+            return
         
-        if file_size > MAX_FILE_SIZE:
-            bot.edit_message_text(
-                lang_manager.get('file_too_large', lang),
+        with STAGE_SECONDS.time(stage='telegram_send', **labels):
+            processing_msg = bot.send_message(
                 message.chat.id,
-                processing_msg.message_id
+                lang_manager.get('processing', lang)
             )
-            transcription_service.cleanup_file(file_path)
-            return
         
-        duration = transcription_service.get_audio_duration(file_path)
-        duration_minutes = duration / 60
+        job = job_queue.submit(user_id, {
+            'chat_id': message.chat.id,
+            'message_id': message.message_id,
+            'processing_msg_id': processing_msg.message_id,
+            'content_type': message.content_type,
+            'media': media,
+            'lang': lang,
+            'transcribe_lang': settings['transcribe_lang'],
+            'task_type': settings['task_type']
+        }, priority=PLAN_CONFIG[plan]['priority'])
         
-        can_use, msg = db.can_use_service(user_id, duration_minutes)
-        if not can_use:
-            quota = db.get_user_quota(user_id)
+        position = job_queue.position(job.id)
+        if position > 0:
             bot.edit_message_text(
-                lang_manager.get('quota_exceeded', lang, used=quota['minutes_used'], limit=quota['minutes_limit']),
+                lang_manager.get('queued', lang, position=position),
                 message.chat.id,
                 processing_msg.message_id
             )
-            transcription_service.cleanup_file(file_path)
-            return
         
-        bot.edit_message_text(
-            lang_manager.get('transcribing', lang),
+    except QueueFullError:
+        bot.send_message(message.chat.id, lang_manager.get('queue_full', lang))
+    except Exception as e:
+        logger.error(f"Error handling media: {e}")
+        bot.send_message(
             message.chat.id,
-            processing_msg.message_id
+            lang_manager.get('error_occurred', lang, error=str(e))
         )
+
+
+def send_quota_exceeded(chat_id, message_id, lang, quota):
+    bot.edit_message_text(
+        lang_manager.get('quota_exceeded', lang, used=quota['minutes_used'], limit=quota['minutes_limit']),
+        chat_id,
+        message_id
+    )
+
+
+def format_result(result, task_type, lang, duration_minutes, quota):
+    """Text of the final result message"""
+    remaining = '∞' if quota['minutes_limit'] == -1 else f"{(quota['minutes_limit'] + quota['bonus_minutes'] - quota['minutes_used']):.1f} دقيقة"
+    
+    result_text = f"{lang_manager.get('transcription_complete' if task_type == 'transcribe' else 'translation_complete', lang)}\n\n"
+    result_text += f"**النص:**\n{result['text'][:1000]}\n\n"
+    result_text += f"━━━━━━━━━━━━━━━━━━━━\n\n"
+    result_text += lang_manager.get(
+        'result_info',
+        lang,
+        duration=f"{result['duration']/60:.1f}",
+        language=lang_manager.get_language_name(result['language']),
+        chars=len(result['text']),
+        processing_time=f"{result['processing_time']:.1f}",
+        used=f"{duration_minutes:.1f}",
+        remaining=remaining
+    )
+    return result_text
+
+
+def deliver_result(chat_id, message_id, result_text, text, lang):
+    """Turn the processing message into the result; errors the user would not see are raised"""
+    if len(result_text) <= 4000:
+        try:
+            bot.edit_message_text(result_text, chat_id, message_id)
+            return
+        except ApiTelegramException as e:
+            # Transcripts often break Markdown, and the processing message may have been deleted
+            logger.warning(f"Could not edit the result into message {message_id}: {e}")
+        bot.send_message(chat_id, result_text, parse_mode='')
+        return
+    
+    try:
+        bot.edit_message_text(lang_manager.get('transcription_complete', lang), chat_id, message_id)
+    except ApiTelegramException as e:
+        logger.warning(f"Could not update message {message_id}: {e}")
+    txt_file = transcription_service.export_as_txt(text)
+    try:
+        with open(txt_file, 'rb') as f:
+            bot.send_document(chat_id, f, caption=lang_manager.get('transcription_complete', lang))
+    finally:
+        transcription_service.cleanup_file(txt_file)
+
+
+def transcribe_media(user_id, data, model, backend, reporter, labels):
+    """Download, decode and transcribe with a quota hold; None when the job was refused"""
+    chat_id = data['chat_id']
+    processing_msg_id = data['processing_msg_id']
+    media = data['media']
+    lang = data['lang']
+    
+    reporter.update(lang_manager.get('downloading', lang), force=True)
+    
+    try:
+        if media['content_type'] == 'video':
+            # Only the audio stream is kept; the video bytes are never written to disk
+            with STAGE_SECONDS.time(stage='extract_audio', **labels):
+                audio, file_size, duration = transcription_service.load_video_audio(media['file_id'])
+        else:
+            with STAGE_SECONDS.time(stage='download', **labels):
+                file_path, file_size = transcription_service.download_file(media['file_id'], media['file_extension'])
+            try:
+                with STAGE_SECONDS.time(stage='decode', **labels):
+                    audio, duration = transcription_service.load_audio(file_path)
+            finally:
+                transcription_service.cleanup_file(file_path)
+    except FileTooLargeError:
+        bot.edit_message_text(
+            lang_manager.get('file_too_large', lang),
+            chat_id,
+            processing_msg_id
+        )
+        return None
+    
+    duration_minutes = duration / 60
+    
+    with STAGE_SECONDS.time(stage='db', **labels):
+        reserved, quota = db.reserve_quota(user_id, duration_minutes)
+    if not reserved:
+        send_quota_exceeded(chat_id, processing_msg_id, lang, quota)
+        return None
+    
+    def on_progress(partial, fraction):
+        preview = partial['text'][-PROGRESS_PREVIEW_CHARS:]
+        reporter.update(f"{lang_manager.get('transcribing_progress', lang, percent=int(fraction * 100))}\n\n{preview}")
+    
+    try:
+        reporter.update(lang_manager.get('transcribing', lang), force=True)
         
+        with STAGE_SECONDS.time(stage='inference', **labels):
+            result = transcription_service.transcribe_audio(
+                audio,
+                language=data['transcribe_lang'],
+                task=data['task_type'],
+                model=model,
+                on_progress=on_progress,
+                backend=backend
+            )
+    except Exception:
+        db.release_quota(user_id, duration_minutes)
+        raise
+    
+    if duration:
+        REAL_TIME_FACTOR.observe(result['processing_time'] / duration, model=f'{backend}/{model}')
+    AUDIO_SECONDS.observe(duration, **labels)
+    
+    with STAGE_SECONDS.time(stage='db', **labels):
+        quota = db.commit_quota(user_id, duration_minutes)
+    result['duration'] = duration
+    
+    if media.get('file_unique_id'):
+        with STAGE_SECONDS.time(stage='db', **labels):
+            db.cache_transcript(media['file_unique_id'], f'{backend}/{model}', data['task_type'], data['transcribe_lang'], result)
+    
+    return result, file_size, duration_minutes, quota
+
+
+def process_media_job(job):
+    """Transcribe (or fetch from cache) and deliver a queued media job (runs on a worker thread)"""
+    user_id = job.user_id
+    data = job.payload
+    chat_id = data['chat_id']
+    processing_msg_id = data['processing_msg_id']
+    media = data['media']
+    lang = data['lang']
+    transcribe_lang = data['transcribe_lang']
+    task_type = data['task_type']
+    
+    reporter = ProgressReporter(bot, chat_id, processing_msg_id)
+    labels = {'plan': 'unknown', 'content_type': data['content_type']}
+    
+    try:
         quota = db.get_user_quota(user_id)
-        plan = quota['plan_type']
-        model = PLAN_CONFIG[plan]['model']
+        plan_config = PLAN_CONFIG[quota['plan_type']]
+        model = plan_config['model']
+        backend = plan_config['backend']
         
-        transcribe_lang = settings['transcribe_lang'] if settings['transcribe_lang'] != 'auto' else 'auto'
-        task_type = settings['task_type']
+        labels['plan'] = quota['plan_type']
+        if job.started_at:
+            QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at, **labels)
         
-        result = transcription_service.transcribe_audio(
-            file_path,
-            language=transcribe_lang,
-            task=task_type,
-            model=model
-        )
-        
-        db.update_usage(user_id, duration_minutes)
+        result = None
+        if media.get('file_unique_id'):
+            with STAGE_SECONDS.time(stage='db', **labels):
+                result = db.get_cached_transcript(media['file_unique_id'], f'{backend}/{model}', task_type, transcribe_lang)
         
-        db.add_usage_stat(
-            user_id,
-            file_type=message.content_type,
-            file_size=file_size,
-            duration_seconds=duration,
-            processing_time=result['processing_time'],
-            language=result['language'],
-            task_type=task_type,
-            characters_count=len(result['text']),
-            words_count=len(result['text'].split())
-        )
+        if result:
+            result['processing_time'] = 0.0
+            file_size = media['file_size'] or 0
+            duration_minutes = result['duration'] / 60 if BILL_CACHE_HITS else 0
+            if duration_minutes:
+                reserved, quota = db.reserve_quota(user_id, duration_minutes)
+                if not reserved:
+                    JOBS.inc(outcome='refused', **labels)
+                    send_quota_exceeded(chat_id, processing_msg_id, lang, quota)
+                    return
+                quota = db.commit_quota(user_id, duration_minutes)
+            JOBS.inc(outcome='cached', **labels)
+            logger.info(f"Served cached transcript of {media['file_unique_id']} to user {user_id}")
+        else:
+            transcribed = transcribe_media(user_id, data, model, backend, reporter, labels)
+            if not transcribed:
+                JOBS.inc(outcome='refused', **labels)
+                return
+            JOBS.inc(outcome='transcribed', **labels)
+            result, file_size, duration_minutes, quota = transcribed
         
-        bot.delete_message(message.chat.id, processing_msg.message_id)
+        duration = result['duration']
         
-        quota = db.get_user_quota(user_id)
-        remaining = '∞' if quota['minutes_limit'] == -1 else f"{(quota['minutes_limit'] + quota['bonus_minutes'] - quota['minutes_used']):.1f} دقيقة"
-        
-        result_text = f"{lang_manager.get('transcription_complete' if task_type == 'transcribe' else 'translation_complete', lang)}\n\n"
-        result_text += f"**النص:**\n{result['text'][:1000]}\n\n"
-        result_text += f"━━━━━━━━━━━━━━━━━━━━\n\n"
-        result_text += lang_manager.get(
-            'result_info',
-            lang,
-            duration=f"{duration/60:.1f}",
-            language=lang_manager.get_language_name(result['language']),
-            chars=len(result['text']),
-            processing_time=f"{result['processing_time']:.1f}",
-            used=f"{duration_minutes:.1f}",
-            remaining=remaining
-        )
+        with STAGE_SECONDS.time(stage='db', **labels):
+            db.add_usage_stat(
+                user_id,
+                file_type=data['content_type'],
+                file_size=file_size,
+                duration_seconds=duration,
+                processing_time=result['processing_time'],
+                language=result['language'],
+                task_type=task_type,
+                characters_count=len(result['text']),
+                words_count=len(result['text'].split())
+            )
         
-        if len(result_text) <= 4000:
-            bot.send_message(message.chat.id, result_text, reply_to_message_id=message.message_id)
-        else:
-            txt_file = transcription_service.export_as_txt(result['text'])
-            with open(txt_file, 'rb') as f:
-                bot.send_document(message.chat.id, f, caption=lang_manager.get('transcription_complete', lang))
-            transcription_service.cleanup_file(txt_file)
+        result_text = format_result(result, task_type, lang, duration_minutes, quota)
         
-        transcription_service.cleanup_file(file_path)
+        # The processing message becomes the result
+        with STAGE_SECONDS.time(stage='telegram_send', **labels):
+            deliver_result(chat_id, processing_msg_id, result_text, result['text'], lang)
         
         logger.info(f"Transcription completed for user {user_id}")
         
     except Exception as e:
+        JOBS.inc(outcome='failed', **labels)
         logger.error(f"Error handling media: {e}")
         bot.send_message(
-            message.chat.id,
+            chat_id,
             lang_manager.get('error_occurred', lang, error=str(e))
         )
+        raise
+
+
+def send_profile_report(chat_id, report):
+    report_file = transcription_service.export_as_txt(report)
+    try:
+        with open(report_file, 'rb') as f:
+            bot.send_document(chat_id, f, caption='Profile report', visible_file_name='profile.txt')
+    finally:
+        transcription_service.cleanup_file(report_file)
+
+
+def runtime_metrics():
+    """Gauges and counters read from the queue, caches and rate limiter when metrics are scraped"""
+    queue_stats = job_queue.get_stats()
+    yield 'transcription_queue_pending', 'Jobs waiting for a worker', 'gauge', {}, queue_stats['pending']
+    yield 'transcription_queue_running', 'Jobs being processed', 'gauge', {}, queue_stats['running']
+    yield 'transcription_workers', 'Worker threads', 'gauge', {}, queue_stats['workers']
+    
+    model_stats = model_cache.get_stats()
+    yield 'model_cache_hit_ratio', 'Model cache hits per lookup', 'gauge', {}, model_stats['hit_rate']
+    yield 'model_cache_memory_mb', 'Estimated memory of resident models', 'gauge', {}, model_stats['memory_used_mb']
+    
+    for cache, stats in db.get_cache_stats().items():
+        yield 'db_cache_hit_ratio', 'In-memory cache hits per lookup', 'gauge', {'cache': cache}, stats['hit_rate']
+    
+    batch_stats = batcher.get_stats()
+    yield 'batch_average_size', 'Clips per micro-batch', 'gauge', {}, batch_stats['average_batch']
+    
+    limiter_stats = bot.get_stats()
+    for key in ('sent', 'queued', 'dropped', 'retried', 'failed'):
+        yield 'telegram_outgoing_total', 'Outgoing Bot API calls by rate limiter outcome', 'counter', {'outcome': key}, limiter_stats[key]
+    yield 'telegram_outgoing_waiting', 'Calls waiting for a rate limit token', 'gauge', {}, limiter_stats['waiting']
+    yield 'telegram_pending_edits', 'Message edits queued for sending', 'gauge', {}, limiter_stats['pending_edits']
 
 
 # ================== Run Bot ==================
 
+def setup():
+    """Configure logging and create the database and services the handlers use"""
+    global db, lang_manager, payments, ui, transcription_service, admission, profiler, job_queue
+    
+    logging.basicConfig(
+        level=getattr(logging, LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('bot.log'),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    
+    db = Database(DATABASE_NAME)
+    lang_manager = LanguageManager()
+    payments = PaymentHandler(bot, db)
+    ui = UIComponents()
+    transcription_service = TranscriptionService(bot)
+    admission = AdmissionControl(bot, db, transcription_service)
+    profiler = JobProfiler(send_profile_report)
+    job_queue = JobQueue(profiler.wrap(process_media_job), store=db)
+    registry.register_collector(runtime_metrics)
+
+
 def main():
     """Main function"""
+    setup()
     logger.info("Bot started successfully!")
     logger.info(f"Bot username: @{BOT_USERNAME}")
     
-    bot.infinity_polling(timeout=60, long_polling_timeout=60)
+    if WARMUP_ENABLED:
+        run_warmup()
+    
+    db.clear_quota_reservations()
+    job_queue.start()
+    
+    if METRICS_ENABLED:
+        try:
+            start_metrics_server()
+        except OSError as e:
+            logger.error(f"Could not serve metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        start_log_summaries()
+    
+    if BOT_MODE == 'webhook':
+        server = WebhookServer(bot)
+        server.register()
+        server.serve_forever()
+    else:
+        bot.remove_webhook()
+        bot.infinity_polling(timeout=60, long_polling_timeout=60)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare inference backends on sample audio: word error rate against reference
+transcripts and speed (real-time factor).
+
+    python compare_backends.py --backends whisper whisper-int8 --models base medium samples/*.ogg
+
+A reference transcript is read from a .txt file next to each audio file
+(samples/note1.ogg -> samples/note1.txt); files without one are timed only.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+from backends import BACKENDS, get_backend
+from long_audio import SAMPLE_RATE
+
+
+def normalize(text):
+    return re.sub(r'[^\w\s]', ' ', text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length"""
+    ref = normalize(reference)
+    hyp = normalize(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def load_samples(paths):
+    import whisper
+
+    samples = []
+    for path in paths:
+        reference_path = os.path.splitext(path)[0] + '.txt'
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding='utf-8') as f:
+                reference = f.read()
+        samples.append((path, whisper.load_audio(path), reference))
+    return samples
+
+
+def run(backend_name, model_name, samples, language):
+    backend = get_backend(backend_name)
+
+    start_time = time.time()
+    model = backend.load(model_name)
+    load_time = time.time() - start_time
+
+    audio_seconds = 0.0
+    processing_time = 0.0
+    errors = []
+    options = {'task': 'transcribe', 'verbose': False}
+    if language != 'auto':
+        options['language'] = language
+
+    for path, audio, reference in samples:
+        start_time = time.time()
+        result = backend.transcribe(model, audio, **options)
+        processing_time += time.time() - start_time
+        audio_seconds += len(audio) / SAMPLE_RATE
+        if reference is not None:
+            errors.append(word_error_rate(reference, result['text']))
+
+    return {
+        'backend': backend_name,
+        'model': model_name,
+        'load_time': load_time,
+        'rtf': processing_time / audio_seconds if audio_seconds else 0.0,
+        'wer': sum(errors) / len(errors) if errors else None
+    }
+
+
+def format_report(rows):
+    baseline = {row['model']: row['rtf'] for row in rows if row['backend'] == 'whisper'}
+    lines = [
+        '| Backend | Model | Load (s) | RTF | Speed-up | WER |',
+        '|---|---|---|---|---|---|'
+    ]
+    for row in rows:
+        speedup = baseline.get(row['model'])
+        speedup = f"{speedup / row['rtf']:.2f}x" if speedup and row['rtf'] else '-'
+        wer = f"{row['wer'] * 100:.1f}%" if row['wer'] is not None else '-'
+        lines.append(
+            f"| {row['backend']} | {row['model']} | {row['load_time']:.1f} | {row['rtf']:.3f} | {speedup} | {wer} |"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inference backends by WER and speed')
+    parser.add_argument('files', nargs='+', help='Audio files; references are read from matching .txt files')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--models', nargs='+', default=['base'])
+    parser.add_argument('--language', default='auto')
+    parser.add_argument('--output', help='Also write the report (markdown) to this file')
+    args = parser.parse_args()
+
+    samples = load_samples(args.files)
+    rows = []
+    for model_name in args.models:
+        for backend_name in args.backends:
+            try:
+                rows.append(run(backend_name, model_name, samples, args.language))
+            except Exception as e:
+                print(f'{backend_name}/{model_name} failed: {e}', file=sys.stderr)
+
+    report = format_report(rows)
+    print(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,12 +9,54 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
 
+# Update Delivery: 'polling' (infinity_polling) or 'webhook' (embedded HTTP server)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public HTTPS URL, WEBHOOK_PATH appended unless it ends with it; empty = don't register
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')  # TLS is terminated by the reverse proxy in front
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))  # updates handled concurrently
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))  # beyond this Telegram is told to retry
+
+# Outgoing Rate Limits (Telegram allows about 30 messages/s overall, 1/s per chat and 20/min per group)
+RATE_LIMIT_GLOBAL = float(os.getenv('RATE_LIMIT_GLOBAL', '25'))  # calls per second
+RATE_LIMIT_PER_CHAT = 1.0
+RATE_LIMIT_PER_GROUP = 20 / 60
+RATE_LIMIT_BURST = 3  # calls a quiet chat may make back to back
+RATE_LIMIT_MAX_RETRIES = 3  # after a 429, waiting retry_after each time
+RATE_LIMIT_EDIT_THREADS = 4  # threads sending queued message edits
+
+# Metrics (Prometheus text format on METRICS_HOST:METRICS_PORT/metrics)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+METRICS_LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', '300'))  # seconds between log summaries, 0 = none
+
+# Asyncio Runtime (python async_bot.py)
+ASYNC_IO_THREADS = int(os.getenv('ASYNC_IO_THREADS', '16'))  # SQLite, ffprobe and the plain handlers
+ASYNC_PROCESSES = int(os.getenv('ASYNC_PROCESSES', '2'))  # ffmpeg and inference
+ASYNC_MAX_JOBS = int(os.getenv('ASYNC_MAX_JOBS', '1000'))  # media jobs in flight before 'queue_full'
+
 # Database
 DATABASE_NAME = 'transcription_bot.db'
+DB_BUSY_TIMEOUT_MS = 5000
+DB_SYNCHRONOUS = 'NORMAL'  # safe with WAL; use FULL to survive power loss
+DB_CACHED_STATEMENTS = 256
+USER_CACHE_SIZE = 10000  # users whose settings/quota are kept in memory
+USER_CACHE_TTL = 300  # seconds
+TRANSCRIPT_CACHE_MAX_MB = int(os.getenv('TRANSCRIPT_CACHE_MAX_MB', '256'))  # stored transcripts, by file_unique_id
+TRANSCRIPT_MEMORY_CACHE_SIZE = 500
+TRANSCRIPT_HITS_FLUSH_SECONDS = 60  # hit counts of memory-served transcripts are written back this often
+BILL_CACHE_HITS = os.getenv('BILL_CACHE_HITS', 'true').lower() == 'true'  # charge quota for cached results
 
 # File Settings
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25 MB
 TEMP_FOLDER = 'temp_files'
+PROBE_TIMEOUT = 3  # seconds for the ffprobe header probe; it runs on the polling thread
+PROBE_HEAD_BYTES = 256 * 1024  # header bytes fetched for the probe
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # connect, read seconds
 
 # Whisper Models
 WHISPER_MODELS = {
@@ -24,12 +66,79 @@ WHISPER_MODELS = {
     'business': 'large-v3'
 }
 
+# Job Queue
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '2'))
+MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', '200'))  # 0 = unbounded
+SCHEDULER_AGING_SECONDS = int(os.getenv('SCHEDULER_AGING_SECONDS', '120'))  # wait that adds one priority level
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '1'))  # concurrent jobs per user, 0 = no cap
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))  # renewed while the job runs
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RECOVERY_INTERVAL = 60  # seconds between scans for abandoned jobs
+JOB_RETENTION_DAYS = 7
+JOB_HISTORY_SIZE = 1000  # finished jobs get_job still reports
+
+# Long Audio (split on silence and transcribed in parallel processes)
+# Each long-audio process loads its own copy of the plan's model, outside MODEL_CACHE_MEMORY_MB:
+# with the 'whisper' backend that is PROCESSES + 1 fp32 copies (about 6 GB each for large-v3).
+# Plans on 'whisper-mmap' share one mapped copy across the processes.
+LONG_AUDIO_PROCESSES = int(os.getenv('LONG_AUDIO_PROCESSES', '2'))  # 0 = disabled
+LONG_AUDIO_THRESHOLD = int(os.getenv('LONG_AUDIO_THRESHOLD', '600'))  # seconds
+LONG_AUDIO_CHUNK_SECONDS = 180
+LONG_AUDIO_SEARCH_SECONDS = 15  # how far from the chunk mark to look for silence
+LONG_AUDIO_THREADS_PER_PROCESS = int(os.getenv('LONG_AUDIO_THREADS_PER_PROCESS', '0'))  # 0 = cpu_count / processes
+
+# Windowed Audio (PCM is decoded into a memory-mapped temp file and transcribed window by window)
+WINDOWED_AUDIO_THRESHOLD = int(os.getenv('WINDOWED_AUDIO_THRESHOLD', '300'))  # seconds, when not sent to the pool
+AUDIO_WINDOW_SECONDS = 30
+DECODE_BLOCK_SECONDS = 10  # PCM converted per read from ffmpeg
+
+# Video Uploads (only the audio stream is demuxed, while the download streams in)
+MAX_VIDEO_SIZE = int(os.getenv('MAX_VIDEO_SIZE', str(MAX_FILE_SIZE)))  # bytes of video we will download
+MAX_VIDEO_SECONDS = int(os.getenv('MAX_VIDEO_SECONDS', '7200'))  # audio past this point is not decoded
+
+# Progress Updates
+PROGRESS_EDIT_INTERVAL = 3.0  # minimum seconds between edits of one message
+PROGRESS_MIN_SECONDS = 90  # shorter audio is transcribed in one pass without partial results
+PROGRESS_CHUNK_SECONDS = 60
+PROGRESS_PREVIEW_CHARS = 3000
+
+# Micro-batching of short clips
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))  # 1 = disabled
+BATCH_MAX_WAIT = float(os.getenv('BATCH_MAX_WAIT', '0.3'))  # seconds the first clip waits for company
+BATCH_MAX_SECONDS = 30  # one mel window
+
+# Inference Backends: 'whisper' (PyTorch fp32), 'whisper-int8' (dynamic int8, CPU),
+# 'whisper-mmap' (fp32 weights memory-mapped from MODEL_STORE_DIR, CPU),
+# 'ctranslate2' (needs faster-whisper); chosen per plan through PLAN_CONFIG['backend']
+DEFAULT_BACKEND = os.getenv('DEFAULT_BACKEND', 'whisper')
+CT2_COMPUTE_TYPE = os.getenv('CT2_COMPUTE_TYPE', 'int8')
+
+# Memory-mapped Model Store (processes loading the same file share one page-cache copy)
+MODEL_STORE_DIR = os.getenv('MODEL_STORE_DIR', 'model_store')
+
+# Startup Warm-up
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_PLANS = [plan.strip() for plan in os.getenv('WARMUP_PLANS', 'free').split(',') if plan.strip()]
+
+# Model Cache
+MODEL_CACHE_MEMORY_MB = int(os.getenv('MODEL_CACHE_MEMORY_MB', '8192'))  # 0 = no limit
+MODEL_IDLE_TIMEOUT = int(os.getenv('MODEL_IDLE_TIMEOUT', '1800'))  # seconds, 0 = never unload
+MODEL_MEMORY_ESTIMATES_MB = {
+    'tiny': 150,
+    'base': 300,
+    'small': 950,
+    'medium': 3000,
+    'large-v2': 6000,
+    'large-v3': 6000
+}
+
 # Plan Configuration
 PLAN_CONFIG = {
     'free': {
         'minutes_limit': 5,
         'is_daily': True,
         'model': 'base',
+        'backend': DEFAULT_BACKEND,
         'export_formats': ['txt', 'srt'],
         'badge': '🆓',
         'priority': 0
@@ -38,6 +147,7 @@ PLAN_CONFIG = {
         'minutes_limit': 180,
         'is_daily': False,
         'model': 'medium',
+        'backend': DEFAULT_BACKEND,
         'export_formats': ['txt', 'srt'],
         'badge': '⭐',
         'priority': 1
@@ -46,6 +156,7 @@ PLAN_CONFIG = {
         'minutes_limit': 600,
         'is_daily': False,
         'model': 'large-v2',
+        'backend': DEFAULT_BACKEND,
         'export_formats': ['txt', 'srt', 'pdf', 'docx'],
         'badge': '💎',
         'priority': 2
@@ -54,6 +165,7 @@ PLAN_CONFIG = {
         'minutes_limit': -1,
         'is_daily': False,
         'model': 'large-v3',
+        'backend': DEFAULT_BACKEND,
         'export_formats': ['txt', 'srt', 'pdf', 'docx', 'vtt'],
         'badge': '👑',
         'priority': 3
@@ -1,30 +1,83 @@
 import sqlite3
+import json
+import time
+import threading
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from contextlib import contextmanager
 import secrets
-from config import DATABASE_NAME, PLAN_CONFIG, REFERRAL_BONUS_MINUTES
+from cache import TTLCache
+from config import (
+    DATABASE_NAME, PLAN_CONFIG, REFERRAL_BONUS_MINUTES,
+    DB_BUSY_TIMEOUT_MS, DB_SYNCHRONOUS, DB_CACHED_STATEMENTS, USER_CACHE_SIZE, USER_CACHE_TTL,
+    TRANSCRIPT_CACHE_MAX_MB, TRANSCRIPT_MEMORY_CACHE_SIZE, TRANSCRIPT_HITS_FLUSH_SECONDS
+)
 
 logger = logging.getLogger(__name__)
 
 class Database:
     def __init__(self, db_name=DATABASE_NAME):
         self.db_name = db_name
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.settings_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self.quota_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self.transcript_cache = TTLCache(TRANSCRIPT_MEMORY_CACHE_SIZE, ttl=0)
+        # cache_key -> [hits, last_used] not yet written to transcript_cache
+        self._transcript_hits = {}
+        self._transcript_hits_lock = threading.Lock()
+        self._transcript_hits_flushed = time.time()
         self.init_database()
     
+    def _connect(self):
+        """Open a long-lived connection for the calling thread"""
+        conn = sqlite3.connect(self.db_name, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}')
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
+        """Yield this thread's pooled connection; the outermost block commits or rolls back"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            self._local.depth = 0
+        
+        self._local.depth += 1
         try:
             yield conn
-            conn.commit()
+            if self._local.depth == 1:
+                conn.commit()
         except Exception as e:
-            conn.rollback()
-            logger.error(f"Database error: {e}")
+            if self._local.depth == 1:
+                conn.rollback()
+                logger.error(f"Database error: {e}")
             raise
         finally:
+            self._local.depth -= 1
+    
+    def get_cache_stats(self):
+        return {
+            'settings': self.settings_cache.get_stats(),
+            'quota': self.quota_cache.get_stats(),
+            'transcripts': self.transcript_cache.get_stats()
+        }
+    
+    def close(self):
+        """Write back pending transcript hits, then close every pooled connection"""
+        self.flush_transcript_hits()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
             conn.close()
+        self._local = threading.local()
     
     def init_database(self):
         with self.get_connection() as conn:
@@ -66,10 +119,25 @@ class Database:
                     last_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     subscription_start TIMESTAMP,
                     subscription_end TIMESTAMP,
+                    reserved_minutes REAL DEFAULT 0,
+                    reset_day INTEGER DEFAULT 0,
                     FOREIGN KEY (user_id) REFERENCES users(user_id)
                 )
             ''')
             
+            cursor.execute('PRAGMA table_info(user_quota)')
+            columns = [column['name'] for column in cursor.fetchall()]
+            if 'reserved_minutes' not in columns:
+                cursor.execute('ALTER TABLE user_quota ADD COLUMN reserved_minutes REAL DEFAULT 0')
+            if 'reset_day' not in columns:
+                cursor.execute('ALTER TABLE user_quota ADD COLUMN reset_day INTEGER DEFAULT 0')
+                # Same numbering as date.toordinal()
+                cursor.execute('''
+                    UPDATE user_quota
+                    SET reset_day = CAST(julianday(date(last_reset)) - julianday('0001-01-01') AS INTEGER) + 1
+                    WHERE last_reset IS NOT NULL
+                ''')
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS usage_stats (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -102,6 +170,50 @@ class Database:
                 )
             ''')
             
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS transcription_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    chat_id INTEGER,
+                    file_id TEXT,
+                    priority INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    payload TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    leased_by TEXT,
+                    lease_expiry REAL,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_transcription_jobs_status
+                ON transcription_jobs (status, lease_expiry)
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS transcript_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    file_unique_id TEXT,
+                    model TEXT,
+                    task_type TEXT,
+                    language TEXT,
+                    result TEXT,
+                    size_bytes INTEGER,
+                    hits INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_used REAL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_transcript_cache_last_used
+                ON transcript_cache (last_used)
+            ''')
+            
             logger.info("Database initialized successfully")
     
     def add_user(self, user_id, username, first_name, last_name, language_code, referral_code=None):
@@ -144,20 +256,32 @@ class Database:
             ''', (user_id, 'ar' if language_code == 'ar' else 'en'))
             
             cursor.execute('''
-                INSERT INTO user_quota (user_id, plan_type, minutes_limit)
-                VALUES (?, 'free', 5)
-            ''', (user_id,))
-            
-            logger.info(f"New user added: {user_id}")
-            return True
+                INSERT INTO user_quota (user_id, plan_type, minutes_limit, reset_day)
+                VALUES (?, 'free', 5, ?)
+            ''', (user_id, self._today()))
+        
+        # Only after the commit: a reader in between would cache the old rows for the full TTL
+        self.settings_cache.delete(user_id)
+        self.quota_cache.delete(user_id)
+        if referred_by_id:
+            self.quota_cache.delete(referred_by_id)
+        
+        logger.info(f"New user added: {user_id}")
+        return True
     
     def get_user_settings(self, user_id):
+        settings = self.settings_cache.get(user_id)
+        if settings is not None:
+            return dict(settings)
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
             result = cursor.fetchone()
             if result:
-                return dict(result)
+                settings = dict(result)
+                self.settings_cache.set(user_id, settings)
+                return dict(settings)
             return {
                 'interface_lang': 'ar',
                 'transcribe_lang': 'auto',
@@ -172,31 +296,57 @@ class Database:
                 UPDATE user_settings SET {setting_name} = ?
                 WHERE user_id = ?
             ''', (value, user_id))
+        self.settings_cache.update(user_id, lambda settings: {**settings, setting_name: value})
     
     def get_user_quota(self, user_id):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM user_quota WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            if result:
+        quota = self.quota_cache.get(user_id)
+        if quota is None:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM user_quota WHERE user_id = ?', (user_id,))
+                result = cursor.fetchone()
+                if not result:
+                    return None
                 quota = dict(result)
-                plan_config = PLAN_CONFIG[quota['plan_type']]
-                if plan_config['is_daily']:
-                    last_reset = datetime.fromisoformat(quota['last_reset'])
-                    if datetime.now().date() > last_reset.date():
-                        self.reset_daily_quota(user_id)
-                        quota['minutes_used'] = 0
-                return quota
-            return None
+                self.quota_cache.set(user_id, quota)
+        
+        return self._current_quota(quota)
+    
+    def _current_quota(self, quota):
+        """Copy of a quota row; usage from an earlier day reads as zero until the next write stores the reset"""
+        quota = dict(quota)
+        if PLAN_CONFIG[quota['plan_type']]['is_daily'] and quota['reset_day'] < self._today():
+            quota['minutes_used'] = 0
+        return quota
     
     def reset_daily_quota(self, user_id):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE user_quota 
-                SET minutes_used = 0, last_reset = CURRENT_TIMESTAMP
+                SET minutes_used = 0, last_reset = CURRENT_TIMESTAMP, reset_day = ?
                 WHERE user_id = ?
-            ''', (user_id,))
+            ''', (self._today(), user_id))
+        self.quota_cache.delete(user_id)
+    
+    @staticmethod
+    def _today():
+        return date.today().toordinal()
+    
+    @staticmethod
+    def _stale_day_sql():
+        """SQL condition, true when a daily plan's stored usage is from before :today"""
+        daily_plans = ', '.join(f"'{plan}'" for plan, config in PLAN_CONFIG.items() if config['is_daily'])
+        return f"(plan_type IN ({daily_plans}) AND reset_day < :today)"
+    
+    def _used_minutes_sql(self):
+        """minutes_used with any pending daily reset applied"""
+        return f"(CASE WHEN {self._stale_day_sql()} THEN 0 ELSE minutes_used END)"
+    
+    def _apply_reset_sql(self):
+        """SET clause that stores a pending daily reset alongside another update"""
+        return f'''last_reset = CASE WHEN {self._stale_day_sql()} THEN CURRENT_TIMESTAMP ELSE last_reset END,
+                    reset_day = :today'''
     
     def can_use_service(self, user_id, duration_minutes):
         quota = self.get_user_quota(user_id)
@@ -207,7 +357,7 @@ class Database:
             return True, "Unlimited"
         
         total_available = quota['minutes_limit'] + quota['bonus_minutes']
-        if quota['minutes_used'] + duration_minutes <= total_available:
+        if quota['minutes_used'] + quota['reserved_minutes'] + duration_minutes <= total_available:
             return True, "OK"
         
         return False, "Quota exceeded"
@@ -215,11 +365,74 @@ class Database:
     def update_usage(self, user_id, duration_minutes):
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
+            cursor.execute(f'''
                 UPDATE user_quota 
-                SET minutes_used = minutes_used + ?
+                SET minutes_used = {self._used_minutes_sql()} + :minutes,
+                    {self._apply_reset_sql()}
+                WHERE user_id = :user_id
+            ''', {'minutes': duration_minutes, 'user_id': user_id, 'today': self._today()})
+            self._refresh_quota(cursor, user_id)
+    
+    def reserve_quota(self, user_id, duration_minutes):
+        """Atomically hold minutes against the quota, return (reserved, fresh quota)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE user_quota
+                SET minutes_used = {self._used_minutes_sql()},
+                    reserved_minutes = reserved_minutes + :minutes,
+                    {self._apply_reset_sql()}
+                WHERE user_id = :user_id
+                  AND (minutes_limit = -1
+                       OR {self._used_minutes_sql()} + reserved_minutes + :minutes <= minutes_limit + bonus_minutes)
+            ''', {'minutes': duration_minutes, 'user_id': user_id, 'today': self._today()})
+            reserved = cursor.rowcount == 1
+            return reserved, self._refresh_quota(cursor, user_id)
+    
+    def commit_quota(self, user_id, reserved_minutes, used_minutes=None):
+        """Turn a hold into usage (used_minutes defaults to the held amount), return fresh quota"""
+        if used_minutes is None:
+            used_minutes = reserved_minutes
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE user_quota
+                SET minutes_used = {self._used_minutes_sql()} + :used,
+                    reserved_minutes = MAX(reserved_minutes - :reserved, 0),
+                    {self._apply_reset_sql()}
+                WHERE user_id = :user_id
+            ''', {'used': used_minutes, 'reserved': reserved_minutes, 'user_id': user_id, 'today': self._today()})
+            return self._refresh_quota(cursor, user_id)
+    
+    def release_quota(self, user_id, reserved_minutes):
+        """Give back a hold whose job failed"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_quota
+                SET reserved_minutes = MAX(reserved_minutes - ?, 0)
                 WHERE user_id = ?
-            ''', (duration_minutes, user_id))
+            ''', (reserved_minutes, user_id))
+            return self._refresh_quota(cursor, user_id)
+    
+    def clear_quota_reservations(self):
+        """Drop holds left behind by jobs that were running when the process stopped"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE user_quota SET reserved_minutes = 0 WHERE reserved_minutes != 0')
+            count = cursor.rowcount
+        self.quota_cache.clear()
+        return count
+    
+    def _refresh_quota(self, cursor, user_id):
+        cursor.execute('SELECT * FROM user_quota WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        if not result:
+            self.quota_cache.delete(user_id)
+            return None
+        quota = dict(result)
+        self.quota_cache.set(user_id, quota)
+        return self._current_quota(quota)
     
     def add_usage_stat(self, user_id, file_type, file_size, duration_seconds, 
                       processing_time, language, task_type, characters_count, words_count):
@@ -228,4 +441,194 @@ class Database:
             cursor.execute('''
                 INSERT INTO usage_stats 
                 (user_id, file_type, file_size, duration_seconds, processing_time, 
-                 language, task_
+                 language, task_type, characters_count, words_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, file_type, file_size, duration_seconds, processing_time,
+                  language, task_type, characters_count, words_count))
+    
+    def get_user_statistics(self, user_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) AS total_requests,
+                       SUM(duration_seconds) / 60.0 AS total_minutes,
+                       SUM(characters_count) AS total_characters
+                FROM usage_stats
+                WHERE user_id = ?
+            ''', (user_id,))
+            stats = dict(cursor.fetchone())
+            
+            cursor.execute('SELECT created_at FROM users WHERE user_id = ?', (user_id,))
+            user = cursor.fetchone()
+            stats['member_since'] = user['created_at'] if user else ''
+            return stats
+    
+    # ================== Transcription Jobs ==================
+    
+    def create_job(self, user_id, payload, priority=0):
+        """Persist a pending job with a snapshot of its settings, return its id"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO transcription_jobs (user_id, chat_id, file_id, priority, payload)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, payload.get('chat_id'), payload.get('media', {}).get('file_id'),
+                  priority, json.dumps(payload)))
+            return cursor.lastrowid
+    
+    def claim_job(self, job_id, worker_id, lease_seconds):
+        """Lease a pending (or abandoned) job to worker_id; False if someone else holds it"""
+        now = time.time()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE transcription_jobs
+                SET status = 'running', leased_by = ?, lease_expiry = ?,
+                    attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                  AND (status = 'pending' OR (status = 'running' AND lease_expiry < ?))
+            ''', (worker_id, now + lease_seconds, job_id, now))
+            return cursor.rowcount == 1
+    
+    def renew_leases(self, job_ids, lease_seconds):
+        if not job_ids:
+            return
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE transcription_jobs SET lease_expiry = ?
+                WHERE status = 'running' AND id IN ({','.join('?' * len(job_ids))})
+            ''', (time.time() + lease_seconds, *job_ids))
+    
+    def finish_job(self, job_id, status, error=None):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE transcription_jobs
+                SET status = ?, error = ?, leased_by = NULL, lease_expiry = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, error, job_id))
+    
+    def get_resumable_jobs(self, max_attempts):
+        """Pending jobs plus running jobs whose lease expired, failing those out of attempts"""
+        now = time.time()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE transcription_jobs
+                SET status = 'failed', error = 'Too many attempts', leased_by = NULL,
+                    lease_expiry = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND lease_expiry < ? AND attempts >= ?
+            ''', (now, max_attempts))
+            if cursor.rowcount:
+                logger.warning(f"Gave up on {cursor.rowcount} transcription jobs after {max_attempts} attempts")
+            
+            cursor.execute('''
+                SELECT *, CAST(strftime('%s', created_at) AS REAL) AS created_ts FROM transcription_jobs
+                WHERE status = 'pending' OR (status = 'running' AND lease_expiry < ?)
+                ORDER BY id
+            ''', (now,))
+            jobs = []
+            for row in cursor.fetchall():
+                job = dict(row)
+                job['payload'] = json.loads(job['payload'])
+                jobs.append(job)
+            return jobs
+    
+    def purge_finished_jobs(self, days):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM transcription_jobs
+                WHERE status IN ('done', 'failed') AND updated_at < datetime('now', ?)
+            ''', (f'-{days} days',))
+            return cursor.rowcount
+    
+    # ================== Transcript Cache ==================
+    
+    @staticmethod
+    def _transcript_key(file_unique_id, model, task_type, language):
+        return f'{file_unique_id}:{model}:{task_type}:{language}'
+    
+    def get_cached_transcript(self, file_unique_id, model, task_type, language):
+        """Stored result for this file and settings, or None"""
+        key = self._transcript_key(file_unique_id, model, task_type, language)
+        result = self.transcript_cache.get(key)
+        
+        if result is None:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT result FROM transcript_cache WHERE cache_key = ?', (key,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                result = json.loads(row['result'])
+            self.transcript_cache.set(key, result)
+        
+        self._count_transcript_hit(key)
+        return dict(result)
+    
+    def _count_transcript_hit(self, key):
+        """Count a hit in memory; counts are written back every TRANSCRIPT_HITS_FLUSH_SECONDS"""
+        now = time.time()
+        with self._transcript_hits_lock:
+            pending = self._transcript_hits.setdefault(key, [0, now])
+            pending[0] += 1
+            pending[1] = now
+            due = now - self._transcript_hits_flushed >= TRANSCRIPT_HITS_FLUSH_SECONDS
+        if due:
+            self.flush_transcript_hits()
+    
+    def flush_transcript_hits(self):
+        """Write the pending hit counts and last_used times in one transaction"""
+        with self._transcript_hits_lock:
+            pending, self._transcript_hits = self._transcript_hits, {}
+            self._transcript_hits_flushed = time.time()
+        if not pending:
+            return
+        
+        with self.get_connection() as conn:
+            conn.executemany('''
+                UPDATE transcript_cache SET hits = hits + ?, last_used = MAX(last_used, ?)
+                WHERE cache_key = ?
+            ''', [(hits, last_used, key) for key, (hits, last_used) in pending.items()])
+    
+    def cache_transcript(self, file_unique_id, model, task_type, language, result):
+        """Store a result, then evict least recently used rows above TRANSCRIPT_CACHE_MAX_MB"""
+        key = self._transcript_key(file_unique_id, model, task_type, language)
+        stored = {
+            'text': result['text'],
+            'language': result['language'],
+            'duration': result['duration'],
+            'segments': [
+                {'id': segment.get('id'), 'start': segment['start'], 'end': segment['end'], 'text': segment['text']}
+                for segment in result.get('segments', [])
+            ]
+        }
+        encoded = json.dumps(stored, ensure_ascii=False)
+        
+        # Eviction goes by last_used, so recent memory hits have to be on disk first
+        self.flush_transcript_hits()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO transcript_cache
+                (cache_key, file_unique_id, model, task_type, language, result, size_bytes, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (key, file_unique_id, model, task_type, language, encoded,
+                  len(encoded.encode('utf-8')), time.time()))
+            
+            cursor.execute('''
+                DELETE FROM transcript_cache WHERE cache_key IN (
+                    SELECT cache_key FROM (
+                        SELECT cache_key, SUM(size_bytes) OVER (ORDER BY last_used DESC) AS total
+                        FROM transcript_cache
+                    ) WHERE total > ?
+                )
+            ''', (TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024,))
+            if cursor.rowcount:
+                logger.info(f"Evicted {cursor.rowcount} cached transcripts")
+                self.transcript_cache.clear()
+        
+        self.transcript_cache.set(key, stored)
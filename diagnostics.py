@@ -0,0 +1,117 @@
+import cProfile
+import functools
+import io
+import pstats
+import resource
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JobProfiler:
+    """cProfile around the next N runs of a wrapped function, reported once all N finished
+
+    Each run is profiled on the thread that executes it; the runs' stats are
+    merged and passed, as text, to on_report(chat_id, report).
+    """
+
+    def __init__(self, on_report):
+        self.on_report = on_report
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._running = 0
+        self._stats = None
+        self._profiled = 0
+        self._wall_time = 0.0
+        self._chat_id = None
+        self._top = 30
+
+    def arm(self, count, chat_id, top=30):
+        """Profile the next count runs and report to chat_id; replaces an earlier request"""
+        with self._lock:
+            self._remaining = count
+            self._stats = None
+            self._profiled = 0
+            self._wall_time = 0.0
+            self._chat_id = chat_id
+            self._top = top
+
+    def disarm(self):
+        with self._lock:
+            armed = self._remaining > 0
+            self._remaining = 0
+        return armed
+
+    def status(self):
+        with self._lock:
+            return {'remaining': self._remaining, 'running': self._running, 'profiled': self._profiled}
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                if self._remaining <= 0:
+                    profile = None
+                else:
+                    self._remaining -= 1
+                    self._running += 1
+                    profile = cProfile.Profile()
+            if profile is None:
+                return func(*args, **kwargs)
+
+            start_time = time.time()
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._collect(profile, time.time() - start_time)
+        return wrapper
+
+    def _collect(self, profile, wall_time):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._running -= 1
+            self._profiled += 1
+            self._wall_time += wall_time
+            if self._remaining > 0 or self._running > 0:
+                return
+            report = self._format_report()
+            chat_id = self._chat_id
+            self._stats = None
+
+        try:
+            self.on_report(chat_id, report)
+        except Exception as e:
+            logger.error(f"Could not deliver profile report: {e}")
+
+    def _format_report(self):
+        """Top functions by cumulative and by own time (lock held)"""
+        output = io.StringIO()
+        output.write(f"{self._profiled} profiled runs, {self._wall_time:.1f}s wall time\n\n")
+        self._stats.stream = output
+        for order in ('cumulative', 'tottime'):
+            output.write(f"=== by {order} ===\n")
+            self._stats.sort_stats(order).print_stats(self._top)
+        return output.getvalue()
+
+
+def process_memory():
+    """Current and peak resident memory of this process in MB"""
+    memory = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM', 'RssAnon', 'RssFile'):
+                    memory[key] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux
+        memory['VmHWM'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    memory['threads'] = threading.active_count()
+    return memory
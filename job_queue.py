@@ -0,0 +1,236 @@
+import itertools
+import os
+from collections import OrderedDict
+import socket
+import threading
+import time
+import logging
+from config import (
+    TRANSCRIPTION_WORKERS, MAX_QUEUE_SIZE, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS,
+    JOB_RECOVERY_INTERVAL, JOB_RETENTION_DAYS, JOB_HISTORY_SIZE
+)
+from scheduler import PriorityScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the transcription queue cannot accept more jobs"""
+
+
+class TranscriptionJob:
+    """A transcription request waiting for or running on a worker"""
+
+    def __init__(self, job_id, user_id, payload, priority=0, created_at=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.payload = payload
+        self.priority = priority
+        self.state = 'queued'
+        self.error = None
+        self.created_at = created_at or time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'priority': self.priority,
+            'state': self.state,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobQueue:
+    """Transcription queue consumed by a pool of background worker threads
+
+    With a store (Database) every job is persisted and leased to the worker
+    running it, so jobs that were queued or running when the process died are
+    picked up again once their lease expires. The last history_size finished
+    jobs stay visible to get_job.
+    """
+
+    def __init__(self, handler, workers=TRANSCRIPTION_WORKERS, max_size=MAX_QUEUE_SIZE, scheduler=None, store=None,
+                 history_size=JOB_HISTORY_SIZE):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.store = store
+        self.history_size = history_size
+        self.worker_prefix = f'{socket.gethostname()}:{os.getpid()}'
+
+        self._scheduler = scheduler or PriorityScheduler()
+        self._jobs = {}
+        self._finished = OrderedDict()
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._threads = []
+
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'recovered': 0
+        }
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f'transcription-worker-{len(self._threads) + 1}',
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        if self.store:
+            self.recover()
+            threading.Thread(target=self._maintenance_loop, name='job-queue-maintenance', daemon=True).start()
+
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    def submit(self, user_id, payload, priority=0):
+        """Queue a job and return it immediately"""
+        with self._condition:
+            if self.max_size and len(self._scheduler) >= self.max_size:
+                raise QueueFullError(f'Queue is full ({self.max_size} jobs)')
+
+            job_id = self.store.create_job(user_id, payload, priority) if self.store else next(self._ids)
+            job = TranscriptionJob(job_id, user_id, payload, priority)
+            self._jobs[job.id] = job
+            self._scheduler.push(job)
+            self.stats['submitted'] += 1
+            self._condition.notify()
+            return job
+
+    def recover(self):
+        """Queue persisted jobs that are pending or whose worker lease expired
+
+        Jobs that do not fit under max_size stay in the store for a later scan.
+        They keep their original created_at, so their aging priority carries over.
+        """
+        recovered = 0
+        for row in self.store.get_resumable_jobs(JOB_MAX_ATTEMPTS):
+            with self._condition:
+                if row['id'] in self._jobs:
+                    continue
+                if self.max_size and len(self._scheduler) >= self.max_size:
+                    break
+                job = TranscriptionJob(
+                    row['id'], row['user_id'], row['payload'], row['priority'], created_at=row['created_ts']
+                )
+                self._jobs[job.id] = job
+                self._scheduler.push(job)
+                self.stats['recovered'] += 1
+                self._condition.notify()
+            recovered += 1
+
+        if recovered:
+            logger.info(f"Recovered {recovered} transcription jobs")
+        return recovered
+
+    def position(self, job_id):
+        """1-based position among pending jobs, 0 when not waiting"""
+        with self._condition:
+            return self._scheduler.position(job_id)
+
+    def depth(self):
+        with self._condition:
+            return len(self._scheduler)
+
+    def get_job(self, job_id):
+        """A queued, running or recently finished job; None when unknown"""
+        with self._condition:
+            return self._jobs.get(job_id) or self._finished.get(job_id)
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._scheduler)
+            stats['running'] = sum(1 for job in self._jobs.values() if job.state == 'running')
+            stats['workers'] = len(self._threads)
+        return stats
+
+    def running_jobs(self):
+        with self._condition:
+            return [job.to_dict() for job in self._jobs.values() if job.state == 'running']
+
+    def _next_job(self):
+        with self._condition:
+            # pop() returns None while every pending job's user is at its concurrency cap
+            job = self._scheduler.pop()
+            while job is None:
+                self._condition.wait()
+                job = self._scheduler.pop()
+            job.state = 'running'
+            job.started_at = time.time()
+            return job
+
+    def _claim(self, job):
+        worker_id = f'{self.worker_prefix}:{threading.current_thread().name}'
+        try:
+            return self.store.claim_job(job.id, worker_id, JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.error(f"Could not claim job {job.id}: {e}")
+            return False
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+
+            if self.store and not self._claim(job):
+                # Leased by another worker or already finished
+                with self._condition:
+                    self._jobs.pop(job.id, None)
+                    self._scheduler.done(job)
+                    self._condition.notify_all()
+                continue
+
+            try:
+                self.handler(job)
+                job.state = 'done'
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+                logger.error(f"Job {job.id} failed: {e}")
+            finally:
+                job.finished_at = time.time()
+                if self.store:
+                    try:
+                        self.store.finish_job(job.id, job.state, job.error)
+                    except Exception as e:
+                        logger.error(f"Could not record result of job {job.id}: {e}")
+                with self._condition:
+                    self._jobs.pop(job.id, None)
+                    self._finished[job.id] = job
+                    while len(self._finished) > self.history_size:
+                        self._finished.popitem(last=False)
+                    self._scheduler.done(job)
+                    self.stats['completed' if job.state == 'done' else 'failed'] += 1
+                    self._condition.notify_all()
+
+    def _maintenance_loop(self):
+        """Renew leases of running jobs, pick up abandoned ones and purge old rows"""
+        interval = max(JOB_LEASE_SECONDS / 3, 1)
+        last_recovery = last_purge = time.time()
+        while True:
+            time.sleep(interval)
+            try:
+                with self._condition:
+                    running = [job.id for job in self._jobs.values() if job.state == 'running']
+                self.store.renew_leases(running, JOB_LEASE_SECONDS)
+
+                now = time.time()
+                if now - last_recovery >= JOB_RECOVERY_INTERVAL:
+                    self.recover()
+                    last_recovery = now
+                if now - last_purge >= 3600:
+                    self.store.purge_finished_jobs(JOB_RETENTION_DAYS)
+                    last_purge = now
+            except Exception as e:
+                logger.error(f"Job queue maintenance failed: {e}")
@@ -58,6 +58,9 @@ class LanguageManager:
                 'processing': '⏳ جاري المعالجة...',
                 'downloading': '📥 جاري التحميل...',
                 'transcribing': '🎯 جاري التفريغ الصوتي...',
+                'queued': '⏳ في قائمة الانتظار - ترتيبك: {position}',
+                'transcribing_progress': '🎯 جاري التفريغ الصوتي... {percent}%',
+                'queue_full': '⚠️ الخدمة مشغولة حالياً، حاول مرة أخرى بعد قليل',
                 
                 'transcription_complete': '✅ **اكتمل التفريغ!**',
                 'translation_complete': '✅ **اكتملت الترجمة!**',
@@ -182,6 +185,9 @@ Send me audio or video''',
                 'processing': '⏳ Processing...',
                 'downloading': '📥 Downloading...',
                 'transcribing': '🎯 Transcribing...',
+                'queued': '⏳ In queue - position {position}',
+                'transcribing_progress': '🎯 Transcribing... {percent}%',
+                'queue_full': '⚠️ The service is busy right now, please try again shortly',
                 
                 'transcription_complete': '✅ **Transcription Complete!**',
                 'translation_complete': '✅ **Translation Complete!**',
@@ -0,0 +1,182 @@
+import os
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import (
+    LONG_AUDIO_PROCESSES, LONG_AUDIO_CHUNK_SECONDS, LONG_AUDIO_SEARCH_SECONDS, LONG_AUDIO_THREADS_PER_PROCESS,
+    PROGRESS_CHUNK_SECONDS, DEFAULT_BACKEND
+)
+from backends import get_backend
+from audio_stream import release_pages
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+SMOOTHING_FRAMES = 10
+ENERGY_BLOCK_FRAMES = 2000  # ~60 s converted at a time
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def frame_energy(audio, sample_rate=SAMPLE_RATE):
+    """Mean power of each 30 ms frame, smoothed over ~300 ms"""
+    frame = int(sample_rate * FRAME_SECONDS)
+    count = len(audio) // frame
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+    energy = np.empty(count, dtype=np.float32)
+    for first in range(0, count, ENERGY_BLOCK_FRAMES):
+        last = min(first + ENERGY_BLOCK_FRAMES, count)
+        frames = np.asarray(audio[first * frame:last * frame], dtype=np.float32).reshape(last - first, frame)
+        energy[first:last] = np.mean(frames ** 2, axis=1)
+    kernel = np.ones(SMOOTHING_FRAMES, dtype=np.float32) / SMOOTHING_FRAMES
+    # Edge padding, not zeros: the ends must not look quieter than they are
+    padded = np.pad(energy, (SMOOTHING_FRAMES // 2, (SMOOTHING_FRAMES - 1) // 2), mode='edge')
+    return np.convolve(padded, kernel, mode='valid')
+
+
+def iter_chunks(audio, sample_rate=SAMPLE_RATE, chunk_seconds=LONG_AUDIO_CHUNK_SECONDS,
+                search_seconds=LONG_AUDIO_SEARCH_SECONDS):
+    """Yield (offset_seconds, samples) cut on silence, looking at one window at a time
+
+    Each cut is the quietest frame within search_seconds of the chunk_seconds
+    mark. The whole signal is never scanned, and the pages of a memory-mapped
+    signal are released as soon as the caller moves on.
+    """
+    chunk = int(chunk_seconds * sample_rate)
+    search = int(search_seconds * sample_rate)
+    frame = int(sample_rate * FRAME_SECONDS)
+
+    start = 0
+    while start < len(audio):
+        end = start + chunk
+        if end + search >= len(audio):
+            end = len(audio)
+        else:
+            low = end - search
+            energy = frame_energy(audio[low:end + search], sample_rate)
+            if len(energy):
+                end = low + int(np.argmin(energy)) * frame
+        yield start / sample_rate, audio[start:end]
+        release_pages(audio, start, end)
+        start = end
+
+
+def stitch_results(chunk_results, language):
+    """Merge per-chunk results into one Whisper-style result with absolute timestamps"""
+    segments = []
+    texts = []
+    for offset, result in chunk_results:
+        texts.append(result['text'].strip())
+        for segment in result.get('segments', []):
+            segment = dict(segment)
+            segment['id'] = len(segments)
+            segment['start'] += offset
+            segment['end'] += offset
+            segments.append(segment)
+    return {
+        'text': ' '.join(text for text in texts if text),
+        'language': language,
+        'segments': segments
+    }
+
+
+def init_worker(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _detect_language(model_name, backend, audio):
+    from model_cache import model_cache
+    return get_backend(backend).detect_language(model_cache.get(model_name, backend), audio)
+
+
+def _transcribe_chunk(model_name, backend, audio, options):
+    from model_cache import model_cache
+    return get_backend(backend).transcribe(model_cache.get(model_name, backend), audio, **options)
+
+
+def get_pool():
+    """Shared process pool; each worker process keeps its own model cache
+
+    With the whisper-mmap backend the workers map the same weight file, so
+    the weights are held in memory once rather than once per process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            threads = LONG_AUDIO_THREADS_PER_PROCESS or max(1, (os.cpu_count() or 1) // LONG_AUDIO_PROCESSES)
+            _pool = ProcessPoolExecutor(
+                max_workers=LONG_AUDIO_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(threads,)
+            )
+        return _pool
+
+
+def transcribe_sequential(backend, model, audio, language='auto', task='transcribe', on_progress=None,
+                          chunk_seconds=PROGRESS_CHUNK_SECONDS):
+    """Transcribe silence-aligned chunks one after another, reporting after each
+
+    The tail of each chunk's text is passed as the next chunk's initial_prompt
+    so the decoder keeps its context across the cut.
+    """
+    duration = len(audio) / SAMPLE_RATE
+    search_seconds = min(LONG_AUDIO_SEARCH_SECONDS, chunk_seconds / 4)
+    options = {'task': task, 'verbose': False}
+    if language != 'auto':
+        options['language'] = language
+
+    results = []
+    prompt = None
+    for offset, samples in iter_chunks(audio, chunk_seconds=chunk_seconds, search_seconds=search_seconds):
+        result = get_backend(backend).transcribe(model, samples, initial_prompt=prompt, **options)
+        options.setdefault('language', result['language'])
+        results.append((offset, result))
+        prompt = result['text'][-200:] or None
+        if on_progress:
+            on_progress(stitch_results(results, options['language']), (offset + len(samples) / SAMPLE_RATE) / duration)
+
+    return stitch_results(results, options.get('language', language))
+
+
+def transcribe_long_audio(audio, model_name, language='auto', task='transcribe', on_progress=None,
+                          backend=DEFAULT_BACKEND):
+    """Transcribe silence-aligned chunks in parallel and stitch them back together"""
+    pool = get_pool()
+
+    if language == 'auto':
+        # All chunks use the language of the opening, as a single transcribe call would
+        language = pool.submit(_detect_language, model_name, backend, audio[:30 * SAMPLE_RATE]).result()
+
+    options = {'task': task, 'language': language, 'verbose': False}
+    results = []
+    in_flight = deque()
+
+    def collect():
+        offset, length, future = in_flight.popleft()
+        results.append((offset, future.result()))
+        if on_progress:
+            on_progress(stitch_results(results, language), (offset * SAMPLE_RATE + length) / len(audio))
+
+    for offset, samples in iter_chunks(audio):
+        # A private copy is pickled, so the mapped pages can go once iter_chunks moves on;
+        # at most one chunk per process plus one waits, which bounds memory whatever the length
+        future = pool.submit(_transcribe_chunk, model_name, backend, np.array(samples), options)
+        in_flight.append((offset, len(samples), future))
+        if len(in_flight) > LONG_AUDIO_PROCESSES:
+            collect()
+    while in_flight:
+        collect()
+
+    logger.info(f"Transcribed {len(audio) / SAMPLE_RATE:.0f}s of audio in {len(results)} chunks")
+    return stitch_results(results, language)
@@ -0,0 +1,250 @@
+import bisect
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)
+DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+class Histogram:
+    """Bucketed observations of one label set; bucket i counts values <= buckets[i]"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other, sign=1):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += sign * count
+        self.sum += sign * other.sum
+        self.count += sign * other.count
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= q * self.count:
+                return bound
+        return self.buckets[-1]
+
+
+class Metric:
+    """A named counter or histogram with one series per label set"""
+
+    def __init__(self, name, kind, help_text, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, also when it raises"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start_time, **labels)
+
+    def series(self):
+        """{label tuple: Histogram copy or counter value}"""
+        with self._lock:
+            if self.kind == 'histogram':
+                return {key: histogram.copy() for key, histogram in self._series.items()}
+            return dict(self._series)
+
+    def merged(self, by):
+        """Histograms summed over every label except by, keyed by its value"""
+        totals = {}
+        for key, histogram in self.series().items():
+            value = dict(key).get(by, '')
+            totals.setdefault(value, Histogram(self.buckets)).merge(histogram)
+        return totals
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+        self._collectors = []
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        metric = Metric(name, 'histogram', help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        metric = Metric(name, 'counter', help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """collector() yields (name, help, kind, labels, value) tuples when metrics are rendered"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key, value in sorted(metric.series().items()):
+                labels = dict(key)
+                if metric.kind == 'counter':
+                    lines.append(f'{metric.name}{_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{metric.name}_bucket{_labels(labels, le=le)} {cumulative}')
+                lines.append(f'{metric.name}_sum{_labels(labels)} {value.sum}')
+                lines.append(f'{metric.name}_count{_labels(labels)} {value.count}')
+
+        described = set()
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, help_text, kind, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f'# HELP {name} {help_text}')
+                    lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'transcription_stage_seconds', 'Time spent in each stage of a media job, by plan and content type'
+)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    'transcription_queue_wait_seconds', 'Time from submission until a worker picks the job up'
+)
+REAL_TIME_FACTOR = registry.histogram(
+    'transcription_real_time_factor', 'Inference time divided by audio duration, by model', RTF_BUCKETS
+)
+AUDIO_SECONDS = registry.histogram(
+    'transcription_audio_seconds', 'Duration of transcribed audio, by plan and content type', DURATION_BUCKETS
+)
+MODEL_LOAD_SECONDS = registry.histogram('model_load_seconds', 'Time to load a model into the cache, by model')
+JOBS = registry.counter('transcription_jobs_total', 'Media jobs by plan, content type and outcome')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.client_address[0]} {format % args}")
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve GET /metrics from a daemon thread"""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Metrics served on http://{httpd.server_address[0]}:{httpd.server_address[1]}/metrics")
+    return httpd
+
+
+def summarize(previous):
+    """One log line covering what was observed since previous (a snapshot returned by the last call)"""
+    snapshot = {
+        'stage': STAGE_SECONDS.merged('stage'),
+        'rtf': REAL_TIME_FACTOR.merged('model'),
+        'wait': QUEUE_WAIT_SECONDS.merged('plan')
+    }
+    parts = []
+    for group, label, unit in (('stage', '', 's'), ('wait', 'queue wait ', 's'), ('rtf', 'rtf ', '')):
+        for name, histogram in sorted(snapshot[group].items()):
+            window = histogram.copy()
+            if name in previous.get(group, {}):
+                window.merge(previous[group][name], sign=-1)
+            if window.count:
+                parts.append(
+                    f"{label}{name}: n={window.count} avg={window.sum / window.count:.2f}{unit} "
+                    f"p95<={window.quantile(0.95)}{unit}"
+                )
+    return '; '.join(parts), snapshot
+
+
+def start_log_summaries(interval=METRICS_LOG_INTERVAL):
+    """Log a summary of the last interval's observations from a daemon thread"""
+    if interval <= 0:
+        return
+
+    def loop():
+        previous = {}
+        while True:
+            time.sleep(interval)
+            try:
+                summary, previous = summarize(previous)
+                if summary:
+                    logger.info(f"Metrics (last {interval}s): {summary}")
+            except Exception as e:
+                logger.error(f"Could not summarize metrics: {e}")
+
+    threading.Thread(target=loop, name='metrics-summary', daemon=True).start()
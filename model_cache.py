@@ -0,0 +1,185 @@
+import gc
+import threading
+import time
+import logging
+from collections import OrderedDict
+from config import MODEL_CACHE_MEMORY_MB, MODEL_IDLE_TIMEOUT, MODEL_MEMORY_ESTIMATES_MB, DEFAULT_BACKEND
+from backends import get_backend
+from metrics import MODEL_LOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _load_model(name, backend):
+    return get_backend(backend).load(name)
+
+
+def _model_size_mb(model, name):
+    """Measure model weights in MB, falling back to the configured estimate"""
+    try:
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+        size += sum(b.numel() * b.element_size() for b in model.buffers())
+        return size / (1024 * 1024)
+    except Exception:
+        return MODEL_MEMORY_ESTIMATES_MB.get(name, 0)
+
+
+class ModelCache:
+    """Process-wide LRU registry of loaded models, keyed by backend and model name"""
+
+    def __init__(self, memory_budget_mb=MODEL_CACHE_MEMORY_MB, idle_timeout=MODEL_IDLE_TIMEOUT, loader=None):
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_timeout = idle_timeout
+        self.loader = loader or _load_model
+
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._sweeper = None
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'evictions': 0,
+            'load_time_total': 0.0,
+            'load_time_last': 0.0
+        }
+
+    def get(self, name, backend=DEFAULT_BACKEND):
+        """Return a loaded model, loading it on first use"""
+        key = f'{backend}/{name}'
+        with self._lock:
+            entry = self._touch(key)
+            if entry:
+                self.stats['hits'] += 1
+                return entry['model']
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given model; the others wait and then hit the cache
+        with load_lock:
+            with self._lock:
+                entry = self._touch(key)
+                if entry:
+                    self.stats['hits'] += 1
+                    return entry['model']
+                self.stats['misses'] += 1
+                self._make_room(MODEL_MEMORY_ESTIMATES_MB.get(name, 0))
+
+            start_time = time.time()
+            model = self.loader(name, backend)
+            load_time = time.time() - start_time
+            size_mb = _model_size_mb(model, name)
+            MODEL_LOAD_SECONDS.observe(load_time, model=key)
+
+            with self._lock:
+                self._models[key] = {
+                    'model': model,
+                    'size_mb': size_mb,
+                    'last_used': time.time()
+                }
+                self.stats['loads'] += 1
+                self.stats['load_time_total'] += load_time
+                self.stats['load_time_last'] = load_time
+                self._make_room(0, keep=key)
+
+            logger.info(f"Loaded model {key} in {load_time:.1f}s ({size_mb:.0f} MB)")
+            self._start_sweeper()
+            return model
+
+    def unload(self, name, backend=DEFAULT_BACKEND):
+        """Drop a model from the cache"""
+        key = f'{backend}/{name}'
+        with self._lock:
+            removed = self._models.pop(key, None)
+        if removed:
+            logger.info(f"Unloaded model {key}")
+            self._release_memory()
+        return removed is not None
+
+    def clear(self):
+        """Drop every cached model"""
+        with self._lock:
+            self._models.clear()
+        self._release_memory()
+
+    def evict_idle(self):
+        """Unload models that have not been used within the idle timeout"""
+        if not self.idle_timeout:
+            return []
+
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            idle = [name for name, entry in self._models.items() if entry['last_used'] < cutoff]
+            for name in idle:
+                del self._models[name]
+                self.stats['evictions'] += 1
+
+        if idle:
+            logger.info(f"Unloaded idle models: {', '.join(idle)}")
+            self._release_memory()
+        return idle
+
+    def memory_used_mb(self):
+        with self._lock:
+            return sum(entry['size_mb'] for entry in self._models.values())
+
+    def get_stats(self):
+        """Counters plus the currently resident models"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['resident'] = {name: round(entry['size_mb']) for name, entry in self._models.items()}
+            stats['memory_used_mb'] = round(sum(entry['size_mb'] for entry in self._models.values()))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _touch(self, name):
+        entry = self._models.get(name)
+        if entry:
+            entry['last_used'] = time.time()
+            self._models.move_to_end(name)
+        return entry
+
+    def _make_room(self, needed_mb, keep=None):
+        """Evict least recently used models until needed_mb fits in the budget (lock held)"""
+        if self.memory_budget_mb <= 0:
+            return
+
+        used = sum(entry['size_mb'] for entry in self._models.values())
+        for name in list(self._models):
+            if used + needed_mb <= self.memory_budget_mb:
+                break
+            if name == keep:
+                continue
+            used -= self._models.pop(name)['size_mb']
+            self.stats['evictions'] += 1
+            logger.info(f"Evicted model {name} to stay within {self.memory_budget_mb} MB")
+
+    def _start_sweeper(self):
+        if not self.idle_timeout or self._sweeper:
+            return
+
+        def sweep():
+            while True:
+                time.sleep(max(self.idle_timeout / 2, 1))
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    logger.error(f"Error evicting idle models: {e}")
+
+        self._sweeper = threading.Thread(target=sweep, name='model-cache-sweeper', daemon=True)
+        self._sweeper.start()
+
+    @staticmethod
+    def _release_memory():
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+
+model_cache = ModelCache()
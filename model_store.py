@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Whisper weights stored as plain fp32 tensors and loaded with mmap
+
+Official checkpoints are fp16, so whisper.load_model() has to cast every
+tensor into a fresh fp32 copy owned by the process. Exported models are
+already fp32 and are mapped read-only from disk: every process that loads
+the same file shares one page-cache copy of the weights.
+
+    python model_store.py large-v3 medium    # export ahead of time
+"""
+
+import os
+import sys
+import time
+import logging
+from config import MODEL_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+stats = {
+    'exports': 0,
+    'loads': 0,
+    'load_time_last': 0.0
+}
+
+
+def model_path(model_name):
+    return os.path.join(MODEL_STORE_DIR, f'{model_name}.pt')
+
+
+def export_model(model_name):
+    """Write the fp32 state dict and dimensions of a whisper model to the store"""
+    import torch
+    import whisper
+
+    start_time = time.time()
+    model = whisper.load_model(model_name, device='cpu')
+    checkpoint = {
+        'dims': model.dims.__dict__,
+        'model_state_dict': {key: value.float() for key, value in model.state_dict().items()}
+    }
+
+    os.makedirs(MODEL_STORE_DIR, exist_ok=True)
+    path = model_path(model_name)
+    # Several processes may export at once; each writes its own file and the rename is atomic
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        torch.save(checkpoint, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    stats['exports'] += 1
+    logger.info(f"Exported {model_name} to {path} in {time.time() - start_time:.1f}s")
+    return path
+
+
+def load_mmap_model(model_name):
+    """Build a whisper model whose weights are memory-mapped from the store, exporting it first if needed"""
+    import numpy as np
+    import torch
+    import whisper
+    from whisper.model import ModelDimensions, Whisper
+
+    path = model_path(model_name)
+    if not os.path.exists(path):
+        export_model(model_name)
+
+    start_time = time.time()
+    checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    dims = ModelDimensions(**checkpoint['dims'])
+
+    # Build on the meta device so no weights are allocated, then adopt the mapped tensors as they are
+    with torch.device('meta'):
+        model = Whisper(dims)
+    model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+
+    # Non-persistent buffers are not in the state dict and are still on meta
+    model.decoder.register_buffer(
+        'mask', torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(-np.inf).triu_(1), persistent=False
+    )
+    all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+    all_heads[dims.n_text_layer // 2:] = True
+    model.register_buffer('alignment_heads', all_heads.to_sparse(), persistent=False)
+    if model_name in whisper._ALIGNMENT_HEADS:
+        model.set_alignment_heads(whisper._ALIGNMENT_HEADS[model_name])
+
+    model.eval()
+    load_time = time.time() - start_time
+    stats['loads'] += 1
+    stats['load_time_last'] = load_time
+    logger.info(f"Mapped {model_name} from {path} in {load_time:.2f}s")
+    return model
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} MODEL [MODEL ...]', file=sys.stderr)
+        sys.exit(2)
+    for model_name in sys.argv[1:]:
+        export_model(model_name)
+        load_mmap_model(model_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import threading
+import time
+from config import PROGRESS_EDIT_INTERVAL
+
+
+class ProgressReporter:
+    """Throttles the progress edits of one status message to one per interval
+
+    An update inside the interval is skipped rather than deferred: the next
+    one carries newer text anyway, and the job's result replaces the message
+    at the end. Edits go through the rate limiter's queue_edit, which
+    coalesces them per message, paces them and never blocks the job.
+    """
+
+    def __init__(self, bot, chat_id, message_id, min_interval=PROGRESS_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+
+        self._lock = threading.Lock()
+        self._last_text = None
+        self._last_edit = 0.0
+
+    def update(self, text, force=False):
+        """Show text unless it is unchanged, or the interval has not passed and force is not set"""
+        with self._lock:
+            now = time.time()
+            if text == self._last_text or (not force and now - self._last_edit < self.min_interval):
+                return
+            self._last_text = text
+            self._last_edit = now
+
+        self.bot.queue_edit(text, self.chat_id, self.message_id)
@@ -0,0 +1,269 @@
+import threading
+import time
+import logging
+from telebot.apihelper import ApiTelegramException
+from config import (
+    RATE_LIMIT_GLOBAL, RATE_LIMIT_PER_CHAT, RATE_LIMIT_PER_GROUP, RATE_LIMIT_BURST, RATE_LIMIT_MAX_RETRIES,
+    RATE_LIMIT_EDIT_THREADS
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_CHATS = 10000
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 when one is)"""
+        self._refill(now)
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class RateLimitedBot:
+    """Wraps a TeleBot so that outgoing messages respect Telegram's flood limits
+
+    send_message, send_document, edit_message_text and delete_message wait
+    for a token from the chat's bucket and from the global bucket; after a 429
+    answer the chat is blocked for retry_after seconds and the call is retried.
+    Errors reach the caller.
+
+    queue_edit, meant for progress messages, never waits. The edit is left in
+    a slot for its message, replacing any edit still pending there, and edit
+    threads send each slot once its chat has a token, so only the newest text
+    of a busy message goes out. A 429 puts the edit back in its slot unless a
+    newer one took it; other failures are only logged. An edit_message_text
+    of the same message discards its pending slot, so a queued progress text
+    never overwrites it. Everything else is passed to the wrapped bot unchanged.
+    """
+
+    def __init__(self, bot, global_rate=RATE_LIMIT_GLOBAL, chat_rate=RATE_LIMIT_PER_CHAT,
+                 group_rate=RATE_LIMIT_PER_GROUP, burst=RATE_LIMIT_BURST, max_retries=RATE_LIMIT_MAX_RETRIES,
+                 edit_threads=RATE_LIMIT_EDIT_THREADS):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.edit_threads = edit_threads
+
+        self._global = TokenBucket(global_rate, max(global_rate, 1))
+        self._chats = {}
+        # (chat_id, message_id) -> (args, kwargs, attempt) of the newest unsent edit
+        self._edits = {}
+        self._sending = set()
+        self._edit_workers = []
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.stats = {
+            'sent': 0,
+            'queued': 0,
+            'dropped': 0,
+            'retried': 0,
+            'failed': 0
+        }
+
+    def __getattr__(self, name):
+        # Handler registration, polling, get_file, token... belong to the wrapped bot
+        return getattr(self.bot, name)
+
+    @property
+    def threaded(self):
+        return self.bot.threaded
+
+    @threaded.setter
+    def threaded(self, value):
+        self.bot.threaded = value
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self._call(chat_id, self.bot.send_message, chat_id, *args, **kwargs)
+
+    def send_document(self, chat_id, *args, **kwargs):
+        return self._call(chat_id, self.bot.send_document, chat_id, *args, **kwargs)
+
+    def delete_message(self, chat_id, *args, **kwargs):
+        return self._call(chat_id, self.bot.delete_message, chat_id, *args, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        key = (chat_id, message_id)
+        with self._changed:
+            if self._edits.pop(key, None):
+                self.stats['dropped'] += 1
+            # A queued edit already on its way must land first
+            self._changed.wait_for(lambda: key not in self._sending)
+        return self._call(chat_id, self.bot.edit_message_text, text, chat_id, message_id, *args, **kwargs)
+
+    def queue_edit(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        """Queue an edit and return None at once; a newer edit of the same message replaces it until it is sent"""
+        key = (chat_id, message_id)
+        with self._changed:
+            if key in self._edits:
+                self.stats['dropped'] += 1
+            self._edits[key] = ((text, chat_id, message_id) + args, kwargs, 0)
+            self._start_edit_workers()
+            self._changed.notify()
+
+    def flush_edits(self, timeout=None):
+        """Wait until every queued edit was sent or given up; False on timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._edits and not self._sending, timeout)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['waiting'] = self._waiting
+            stats['pending_edits'] = len(self._edits)
+            stats['tracked_chats'] = len(self._chats)
+        return stats
+
+    def _call(self, chat_id, method, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._wait_turn(chat_id)
+            try:
+                result = method(*args, **kwargs)
+                with self._lock:
+                    self.stats['sent'] += 1
+                return result
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == self.max_retries:
+                    raise
+                self._block(chat_id, e, method.__name__)
+                # Uploaded files were consumed by the failed attempt
+                for value in list(args) + list(kwargs.values()):
+                    if hasattr(value, 'seek'):
+                        value.seek(0)
+
+    def _wait_turn(self, chat_id):
+        """Take a token from the chat and global buckets, sleeping as needed"""
+        queued = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    buckets = self._buckets(chat_id)
+                    wait = max(bucket.wait_time(now) for bucket in buckets)
+                    if wait <= 0:
+                        for bucket in buckets:
+                            bucket.take()
+                        return
+
+                    if not queued:
+                        queued = True
+                        self.stats['queued'] += 1
+                        self._waiting += 1
+                time.sleep(wait)
+        finally:
+            if queued:
+                with self._lock:
+                    self._waiting -= 1
+
+    def _block(self, chat_id, error, method_name):
+        """Hold every call to the chat for the retry_after of a 429"""
+        retry_after = (error.result_json.get('parameters') or {}).get('retry_after', 1)
+        logger.warning(f"Telegram flood limit in chat {chat_id}, retrying {method_name} in {retry_after}s")
+        with self._changed:
+            self.stats['retried'] += 1
+            bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+            bucket.blocked_until = time.monotonic() + retry_after
+            self._changed.notify_all()
+
+    def _start_edit_workers(self):
+        """Start the edit threads on the first edit (lock held)"""
+        while len(self._edit_workers) < self.edit_threads:
+            thread = threading.Thread(
+                target=self._edit_loop, name=f'telegram-edits-{len(self._edit_workers)}', daemon=True
+            )
+            thread.start()
+            self._edit_workers.append(thread)
+
+    def _edit_loop(self):
+        while True:
+            with self._changed:
+                key, (args, kwargs, attempt) = self._next_edit()
+            try:
+                self._send_edit(key, args, kwargs, attempt)
+            finally:
+                with self._changed:
+                    self._sending.discard(key)
+                    self._changed.notify_all()
+
+    def _next_edit(self):
+        """Take out a pending edit whose chat has a token, waiting until one does (lock held)
+
+        A message with an edit in flight is skipped so its edits never overtake each other.
+        """
+        while True:
+            now = time.monotonic()
+            wait = None
+            for key in self._edits:
+                if key in self._sending:
+                    continue
+                buckets = self._buckets(key[0])
+                delay = max(bucket.wait_time(now) for bucket in buckets)
+                if delay <= 0:
+                    for bucket in buckets:
+                        bucket.take()
+                    self._sending.add(key)
+                    return key, self._edits.pop(key)
+                wait = delay if wait is None else min(wait, delay)
+            self._changed.wait(wait)
+
+    def _send_edit(self, key, args, kwargs, attempt):
+        try:
+            self.bot.edit_message_text(*args, **kwargs)
+            with self._lock:
+                self.stats['sent'] += 1
+        except ApiTelegramException as e:
+            if e.error_code == 429 and attempt < self.max_retries:
+                self._block(key[0], e, 'edit_message_text')
+                with self._changed:
+                    # A newer edit that arrived meanwhile wins
+                    self._edits.setdefault(key, (args, kwargs, attempt + 1))
+                return
+            with self._lock:
+                self.stats['failed'] += 1
+            logger.warning(f"Could not edit message {key[1]} in chat {key[0]}: {e}")
+        except Exception as e:
+            with self._lock:
+                self.stats['failed'] += 1
+            logger.warning(f"Could not edit message {key[1]} in chat {key[0]}: {e}")
+
+    def _buckets(self, chat_id):
+        """Global bucket plus the chat's, if any (lock held)"""
+        if chat_id is None:
+            return [self._global]
+        return [self._global, self._chat_bucket(chat_id)]
+
+    def _chat_bucket(self, chat_id):
+        """Bucket of one chat, created on first use (lock held)"""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_TRACKED_CHATS:
+                now = time.monotonic()
+                for idle_chat in [chat for chat, b in self._chats.items() if b.idle(now)]:
+                    del self._chats[idle_chat]
+            # Group and channel ids are negative
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
@@ -0,0 +1,53 @@
+import time
+from collections import defaultdict
+from config import SCHEDULER_AGING_SECONDS, MAX_JOBS_PER_USER
+
+
+class PriorityScheduler:
+    """Orders pending jobs by plan priority, aged by waiting time, with per-user caps"""
+
+    def __init__(self, aging_seconds=SCHEDULER_AGING_SECONDS, max_jobs_per_user=MAX_JOBS_PER_USER):
+        self.aging_seconds = aging_seconds
+        self.max_jobs_per_user = max_jobs_per_user
+        self._pending = []
+        self._running = defaultdict(int)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def effective_priority(self, job, now=None):
+        """Plan priority plus one level for every aging_seconds spent waiting"""
+        if not self.aging_seconds:
+            return job.priority
+        waited = (now or time.time()) - job.created_at
+        return job.priority + waited / self.aging_seconds
+
+    def ordered(self):
+        """Pending jobs in the order they would be picked, ignoring per-user caps"""
+        now = time.time()
+        return sorted(self._pending, key=lambda job: (-self.effective_priority(job, now), job.created_at))
+
+    def push(self, job):
+        self._pending.append(job)
+
+    def pop(self):
+        """Remove and return the best job whose user is under the cap, or None"""
+        for job in self.ordered():
+            if self.max_jobs_per_user and self._running[job.user_id] >= self.max_jobs_per_user:
+                continue
+            self._pending.remove(job)
+            self._running[job.user_id] += 1
+            return job
+        return None
+
+    def done(self, job):
+        """Release the job's slot in its user's concurrency cap"""
+        self._running[job.user_id] -= 1
+        if self._running[job.user_id] <= 0:
+            del self._running[job.user_id]
+
+    def position(self, job_id):
+        for index, job in enumerate(self.ordered(), 1):
+            if job.id == job_id:
+                return index
+        return 0
@@ -0,0 +1,26 @@
+from audio_stream import moov_first
+
+
+def box(name, size):
+    return size.to_bytes(4, 'big') + name + b'\0' * (size - 8)
+
+
+FTYP = box(b'ftyp', 32)
+
+
+def test_moov_before_mdat_streams():
+    assert moov_first(FTYP + box(b'moov', 1024) + box(b'mdat', 64))
+
+
+def test_mdat_before_moov_does_not_stream():
+    assert not moov_first(FTYP + box(b'mdat', 1024) + box(b'moov', 64))
+
+
+def test_inconclusive_mp4_header_does_not_stream():
+    head = FTYP + box(b'free', 300 * 1024)
+    assert not moov_first(head[:256 * 1024])
+
+
+def test_other_containers_stream():
+    assert moov_first(b'OggS' + b'\0' * 1000)
+    assert moov_first(b'\x1aE\xdf\xa3' + b'\0' * 1000)
@@ -0,0 +1,24 @@
+import numpy as np
+
+from long_audio import SAMPLE_RATE, frame_energy, iter_chunks
+
+
+def noise(seconds, level, seed=0):
+    return (np.random.default_rng(seed).standard_normal(int(seconds * SAMPLE_RATE)) * level).astype(np.float32)
+
+
+def test_smoothing_keeps_the_edges_level():
+    energy = frame_energy(noise(10, 0.1))
+    assert energy[0] > 0.8 * np.median(energy)
+    assert energy[-1] > 0.8 * np.median(energy)
+
+
+def test_cuts_land_on_a_shallow_dip_not_the_search_window_edge():
+    audio = noise(120, 0.1)
+    # A pause that is only 40% quieter, 3 s after the first 30 s mark
+    dip = slice(33 * SAMPLE_RATE, int(33.5 * SAMPLE_RATE))
+    audio[dip] *= np.sqrt(0.6)
+
+    offsets = [offset for offset, _ in iter_chunks(audio, chunk_seconds=30, search_seconds=7.5)]
+
+    assert 33 <= offsets[1] <= 33.5
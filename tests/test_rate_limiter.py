@@ -0,0 +1,90 @@
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from rate_limiter import RateLimitedBot
+
+
+class FakeBot:
+    def __init__(self, delay=0.0, flood_first=False):
+        self.delay = delay
+        self.flood_first = flood_first
+        self.edits = []
+        self.lock = threading.Lock()
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        time.sleep(self.delay)
+        with self.lock:
+            if self.flood_first:
+                self.flood_first = False
+                raise ApiTelegramException(
+                    'editMessageText', None,
+                    {'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': 0.2}}
+                )
+            self.edits.append((chat_id, message_id, text))
+
+
+def test_rapid_edits_are_coalesced():
+    fake = FakeBot(delay=0.05)
+    bot = RateLimitedBot(fake, global_rate=30, chat_rate=5, burst=1)
+
+    start = time.monotonic()
+    for index in range(20):
+        bot.queue_edit(f'progress {index}', 1, 10)
+    # Editing never waits for a token
+    assert time.monotonic() - start < 0.1
+
+    assert bot.flush_edits(timeout=5)
+    assert 0 < len(fake.edits) < 20
+    assert fake.edits[-1] == (1, 10, 'progress 19')
+    assert bot.get_stats()['dropped'] == 20 - len(fake.edits)
+
+
+def test_edits_of_other_messages_are_kept():
+    fake = FakeBot()
+    bot = RateLimitedBot(fake, global_rate=30, chat_rate=30, burst=5)
+
+    bot.queue_edit('a', 1, 10)
+    bot.queue_edit('b', 1, 11)
+    bot.queue_edit('c', 2, 10)
+
+    assert bot.flush_edits(timeout=5)
+    assert sorted(fake.edits) == [(1, 10, 'a'), (1, 11, 'b'), (2, 10, 'c')]
+
+
+def test_flood_limit_requeues_the_edit():
+    fake = FakeBot(flood_first=True)
+    bot = RateLimitedBot(fake, global_rate=30, chat_rate=30, burst=5)
+
+    start = time.monotonic()
+    bot.queue_edit('first', 1, 10)
+    assert time.monotonic() - start < 0.1
+
+    assert bot.flush_edits(timeout=5)
+    assert time.monotonic() - start >= 0.2
+    assert fake.edits == [(1, 10, 'first')]
+    assert bot.get_stats()['retried'] == 1
+
+
+def test_blocking_edit_discards_queued_progress_and_raises():
+    fake = FakeBot()
+    bot = RateLimitedBot(fake, global_rate=30, chat_rate=2, burst=1)
+
+    bot.queue_edit('progress', 1, 10)
+    bot.queue_edit('more progress', 1, 10)
+    bot.edit_message_text('result', 1, 10)
+    assert bot.flush_edits(timeout=5)
+    assert fake.edits[-1] == (1, 10, 'result')
+
+    def fail(*args, **kwargs):
+        raise ApiTelegramException(
+            'editMessageText', None, {'error_code': 400, 'description': "Bad Request: can't parse entities"}
+        )
+    fake.edit_message_text = fail
+    try:
+        bot.edit_message_text('*broken', 1, 10)
+    except ApiTelegramException as e:
+        assert e.error_code == 400
+    else:
+        raise AssertionError('the edit error was swallowed')
@@ -1,58 +1,230 @@
 import os
+import itertools
 import tempfile
-from config import TEMP_FOLDER
+import threading
+import requests
+from telebot import apihelper
+from config import (
+    TEMP_FOLDER, MAX_FILE_SIZE, MAX_VIDEO_SIZE, MAX_VIDEO_SECONDS, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT, LONG_AUDIO_PROCESSES, LONG_AUDIO_THRESHOLD,
+    PROGRESS_MIN_SECONDS, PROGRESS_CHUNK_SECONDS, WINDOWED_AUDIO_THRESHOLD, AUDIO_WINDOW_SECONDS,
+    BATCH_MAX_SECONDS, DEFAULT_BACKEND
+)
+from backends import get_backend
+from model_cache import model_cache
+from long_audio import SAMPLE_RATE, transcribe_long_audio, transcribe_sequential, init_worker
+from batching import batcher
+from audio_stream import decode_audio, decode_stream, open_pcm, moov_first
 import logging
 
 logger = logging.getLogger(__name__)
 
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 
+class FileTooLargeError(Exception):
+    """Raised when a download exceeds MAX_FILE_SIZE"""
+
 class TranscriptionService:
     """Transcription Service"""
     
-    def __init__(self, bot):
+    def __init__(self, bot, max_file_size=MAX_FILE_SIZE, max_video_size=MAX_VIDEO_SIZE):
         self.bot = bot
+        self.max_file_size = max_file_size
+        self.max_video_size = max_video_size
+        self._local = threading.local()
+    
+    def _get_session(self):
+        """Keep-alive HTTP session to the Bot API file endpoint, one per thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+    
+    def get_file_url(self, file_path):
+        url_format = apihelper.FILE_URL or 'https://api.telegram.org/file/bot{0}/{1}'
+        return url_format.format(self.bot.token, file_path)
+    
+    def read_head(self, file_path, size, timeout=DOWNLOAD_TIMEOUT):
+        """First size bytes of a Telegram file, fetched with a Range request"""
+        head = bytearray()
+        with self._get_session().get(
+            self.get_file_url(file_path),
+            headers={'Range': f'bytes=0-{size - 1}'},
+            stream=True,
+            timeout=timeout,
+            proxies=apihelper.proxy
+        ) as response:
+            response.raise_for_status()
+            # A server that ignores Range sends the whole file; stop reading at size
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                head += chunk
+                if len(head) >= size:
+                    break
+        return bytes(head[:size])
+    
+    def iter_file_chunks(self, file_id, max_size=None):
+        """Stream a Telegram file in DOWNLOAD_CHUNK_SIZE pieces, aborting once it exceeds max_size"""
+        max_size = max_size or self.max_file_size
+        file_info = self.bot.get_file(file_id)
+        if file_info.file_size and file_info.file_size > max_size:
+            raise FileTooLargeError(f'File is {file_info.file_size} bytes')
+        
+        with self._get_session().get(
+            self.get_file_url(file_info.file_path),
+            stream=True,
+            timeout=DOWNLOAD_TIMEOUT,
+            proxies=apihelper.proxy
+        ) as response:
+            response.raise_for_status()
+            
+            received = 0
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_size:
+                    raise FileTooLargeError(f'File exceeded {max_size} bytes while downloading')
+                yield chunk
     
     def download_file(self, file_id, file_extension='mp3'):
-        """Download file from Telegram"""
+        """Download file from Telegram straight to disk, return (path, size)"""
+        temp_file = tempfile.NamedTemporaryFile(
+            delete=False,
+            suffix=f'.{file_extension}',
+            dir=TEMP_FOLDER
+        )
         try:
-            file_info = self.bot.get_file(file_id)
-            downloaded_file = self.bot.download_file(file_info.file_path)
-            
-            temp_file = tempfile.NamedTemporaryFile(
-                delete=False,
-                suffix=f'.{file_extension}',
-                dir=TEMP_FOLDER
-            )
-            temp_file.write(downloaded_file)
-            temp_file.close()
+            with temp_file:
+                for chunk in self.iter_file_chunks(file_id):
+                    temp_file.write(chunk)
             
             file_size = os.path.getsize(temp_file.name)
             
             return temp_file.name, file_size
         except Exception as e:
-            logger.error(f'Error downloading file: {e}')
+            self.cleanup_file(temp_file.name)
+            if not isinstance(e, FileTooLargeError):
+                logger.error(f'Error downloading file: {e}')
+            raise
+    
+    def load_video_audio(self, file_id):
+        """Decode only the audio stream of a video while it downloads, return (audio, bytes_read, duration)"""
+        return self.load_streamed_audio(file_id, video=True)
+    
+    def load_streamed_audio(self, file_id, video=False, pcm_path=None):
+        """Decode a file while it downloads, return (audio, bytes_read, duration)
+
+        The downloaded bytes are piped straight into ffmpeg and never stored;
+        of a video only the audio stream is decoded. MP4 files whose moov
+        index sits after the media data cannot be demuxed from a pipe; those
+        are written to a temp file (still capped by the size limit) and
+        demuxed from there. pcm_path: decode into this file, which the caller
+        removes, instead of an unlinked temp file.
+        """
+        received = [0]
+        
+        def counted(chunks):
+            for chunk in chunks:
+                received[0] += len(chunk)
+                yield chunk
+        
+        max_size = self.max_video_size if video else self.max_file_size
+        max_seconds = MAX_VIDEO_SECONDS if video else None
+        chunks = counted(self.iter_file_chunks(file_id, max_size=max_size))
+        head = next(chunks, b'')
+        
+        try:
+            if moov_first(head):
+                audio = decode_stream(
+                    itertools.chain([head], chunks), max_seconds=max_seconds, audio_only=video, pcm_path=pcm_path
+                )
+            else:
+                logger.info(f'File {file_id} has its index at the end, demuxing from disk')
+                audio = self._decode_downloaded(head, chunks, max_seconds, video, pcm_path)
+        except Exception as e:
+            if not isinstance(e, FileTooLargeError):
+                logger.error(f'Error extracting audio from stream: {e}')
+            raise
+        
+        duration = len(audio) / SAMPLE_RATE
+        if max_seconds and duration >= max_seconds:
+            logger.info(f'Video {file_id} audio truncated to {max_seconds}s')
+        return audio, received[0], duration
+    
+    def _decode_downloaded(self, head, chunks, max_seconds, audio_only, pcm_path):
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', dir=TEMP_FOLDER)
+        try:
+            with temp_file:
+                temp_file.write(head)
+                for chunk in chunks:
+                    temp_file.write(chunk)
+            return decode_audio(temp_file.name, max_seconds=max_seconds, audio_only=audio_only, pcm_path=pcm_path)
+        finally:
+            self.cleanup_file(temp_file.name)
+    
+    def load_audio(self, file_path):
+        """Decode file once into a 16 kHz mono float32 array (memory-mapped from disk), return (audio, duration)"""
+        try:
+            audio = decode_audio(file_path)
+            duration = len(audio) / SAMPLE_RATE
+            return audio, duration
+        except Exception as e:
+            logger.error(f'Error decoding audio: {e}')
             raise
     
-    def transcribe_audio(self, file_path, language='auto', task='transcribe', model='base'):
-        """Transcribe audio using Whisper"""
+    def is_long_audio(self, audio):
+        """Decoded audio long enough to be split across the process pool"""
+        return (LONG_AUDIO_PROCESSES > 0 and not isinstance(audio, str)
+                and len(audio) / SAMPLE_RATE >= LONG_AUDIO_THRESHOLD)
+    
+    def is_windowed(self, audio, on_progress=None):
+        """Decoded audio to transcribe window by window: long, or long enough to report progress on"""
+        if isinstance(audio, str):
+            return False
+        duration = len(audio) / SAMPLE_RATE
+        return duration >= WINDOWED_AUDIO_THRESHOLD or (on_progress is not None and duration >= PROGRESS_MIN_SECONDS)
+    
+    def is_batchable(self, audio, backend=DEFAULT_BACKEND):
+        """Decoded clip short enough for a single 30-second mel window, on a backend that batches"""
+        return (batcher.can_batch() and not isinstance(audio, str)
+                and len(audio) / SAMPLE_RATE <= BATCH_MAX_SECONDS
+                and get_backend(backend).capabilities()['batching'])
+    
+    def transcribe_audio(self, audio, language='auto', task='transcribe', model='base', on_progress=None,
+                         backend=DEFAULT_BACKEND, offloaded=False):
+        """Transcribe audio with the plan's backend; audio is a file path or an array from load_audio
+
+        on_progress(partial_result, fraction_done) is called as segments complete.
+        offloaded: already running in a pool process, so no nested pool and no batching.
+        """
         try:
-            import whisper
             import time
             
             start_time = time.time()
             
-            whisper_model = whisper.load_model(model)
-            
-            transcribe_options = {
-                'task': task,
-                'verbose': False
-            }
-            
-            if language != 'auto':
-                transcribe_options['language'] = language
-            
-            result = whisper_model.transcribe(file_path, **transcribe_options)
+            if not offloaded and self.is_long_audio(audio):
+                result = transcribe_long_audio(
+                    audio, model, language=language, task=task, on_progress=on_progress, backend=backend
+                )
+            elif self.is_windowed(audio, on_progress):
+                # Only one window of a memory-mapped signal is resident at a time
+                long_enough = len(audio) / SAMPLE_RATE >= WINDOWED_AUDIO_THRESHOLD
+                result = transcribe_sequential(
+                    backend, model_cache.get(model, backend), audio, language=language, task=task,
+                    on_progress=on_progress,
+                    chunk_seconds=AUDIO_WINDOW_SECONDS if long_enough else PROGRESS_CHUNK_SECONDS
+                )
+            elif not offloaded and self.is_batchable(audio, backend):
+                result = batcher.transcribe(audio, model, language=language, task=task, backend=backend)
+            else:
+                loaded_model = model_cache.get(model, backend)
+                
+                transcribe_options = {
+                    'task': task,
+                    'verbose': False
+                }
+                
+                if language != 'auto':
+                    transcribe_options['language'] = language
+                
+                result = get_backend(backend).transcribe(loaded_model, audio, **transcribe_options)
             
             processing_time = time.time() - start_time
             
@@ -70,9 +242,7 @@ class TranscriptionService:
     def get_audio_duration(self, file_path):
         """Get audio file duration"""
         try:
-            import whisper
-            audio = whisper.load_audio(file_path)
-            duration = len(audio) / whisper.audio.SAMPLE_RATE
+            _, duration = self.load_audio(file_path)
             return duration
         except Exception as e:
             logger.error(f'Error getting audio duration: {e}')
@@ -126,3 +296,18 @@ class TranscriptionService:
                 os.unlink(file_path)
         except Exception as e:
             logger.error(f'Error cleaning up file: {e}')
+
+
+def init_offload_worker(threads, warmup=False):
+    """Process-pool initializer for the asyncio runtime"""
+    init_worker(threads)
+    if warmup:
+        from warmup import run_warmup
+        run_warmup()
+
+
+def transcribe_pcm(pcm_path, language='auto', task='transcribe', model='base', backend=DEFAULT_BACKEND):
+    """Process-pool entry point: transcribe a PCM file written by load_streamed_audio"""
+    return TranscriptionService(None).transcribe_audio(
+        open_pcm(pcm_path), language=language, task=task, model=model, backend=backend, offloaded=True
+    )
@@ -0,0 +1,62 @@
+import time
+import logging
+import numpy as np
+from config import PLAN_CONFIG, WARMUP_PLANS
+from backends import get_backend, SAMPLE_RATE
+from model_cache import model_cache
+
+logger = logging.getLogger(__name__)
+
+readiness = {
+    'ready': False,
+    'steps': {},
+    'total_time': 0.0
+}
+
+
+def _timed(name, func):
+    start_time = time.time()
+    try:
+        func()
+        elapsed = time.time() - start_time
+        readiness['steps'][name] = round(elapsed, 2)
+        logger.info(f"Warm-up: {name} took {elapsed:.1f}s")
+    except Exception as e:
+        readiness['steps'][name] = f'failed: {e}'
+        logger.error(f"Warm-up: {name} failed: {e}")
+
+
+def _dummy_inference(model_name, backend):
+    # One second of silence exercises language detection, encoder and decoder once
+    get_backend(backend).transcribe(
+        model_cache.get(model_name, backend),
+        np.zeros(SAMPLE_RATE, dtype=np.float32),
+        task='transcribe',
+        verbose=False
+    )
+
+
+def run_warmup(plans=WARMUP_PLANS):
+    """Import torch/whisper, load the plans' models and run one inference each"""
+    start_time = time.time()
+
+    _timed('import torch', lambda: __import__('torch'))
+    _timed('import whisper', lambda: __import__('whisper'))
+
+    targets = []
+    for plan in plans:
+        if plan not in PLAN_CONFIG:
+            logger.warning(f"Warm-up: unknown plan '{plan}'")
+            continue
+        target = (PLAN_CONFIG[plan]['model'], PLAN_CONFIG[plan]['backend'])
+        if target not in targets:
+            targets.append(target)
+
+    for model_name, backend in targets:
+        _timed(f'load {backend}/{model_name}', lambda: model_cache.get(model_name, backend))
+        _timed(f'inference {backend}/{model_name}', lambda: _dummy_inference(model_name, backend))
+
+    readiness['total_time'] = round(time.time() - start_time, 2)
+    readiness['ready'] = True
+    logger.info(f"Warm-up finished in {readiness['total_time']:.1f}s: {readiness['steps']}")
+    return readiness
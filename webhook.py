@@ -0,0 +1,169 @@
+import hmac
+import json
+import queue
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot.types import Update
+from config import (
+    WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_MAX_PENDING
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class UpdateDispatcher:
+    """Bounded queue of updates handled by a fixed number of threads"""
+
+    def __init__(self, bot, workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING):
+        self.bot = bot
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._threads = []
+        self.stats = {
+            'received': 0,
+            'processed': 0,
+            'rejected': 0,
+            'failed': 0
+        }
+        self._lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'update-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, update):
+        """Queue an update; False when the dispatcher is full"""
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('received')
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['pending'] = self.depth()
+        return stats
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _worker_loop(self):
+        while True:
+            update = self._queue.get()
+            try:
+                self.bot.process_new_updates([update])
+                self._count('processed')
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"Error handling update {update.update_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server_version = 'TranscriptionBot'
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.path:
+            self._reply(404)
+            return
+
+        # Compared in constant time, as bytes so a non-ASCII header is rejected rather than raising;
+        # a missing header never matches a configured secret
+        token = self.headers.get(SECRET_HEADER, '').encode()
+        if server.secret and not hmac.compare_digest(token, server.secret.encode()):
+            logger.warning(f"Rejected webhook request from {self.client_address[0]}: bad secret token")
+            self._reply(403)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if not 0 < length <= MAX_BODY_BYTES:
+            self._reply(413 if length else 400)
+            return
+
+        try:
+            update = Update.de_json(json.loads(self.rfile.read(length)))
+        except Exception as e:
+            logger.warning(f"Malformed webhook update: {e}")
+            self._reply(400)
+            return
+
+        # A non-2xx answer makes Telegram redeliver the update later
+        self._reply(200 if server.dispatcher.submit(update) else 503)
+
+    def do_GET(self):
+        self._reply(404)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.client_address[0]} {format % args}")
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and hands them to an UpdateDispatcher
+
+    Recorded updates can be replayed locally with, e.g.
+    curl -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' -d @update.json http://127.0.0.1:8080/webhook
+    """
+
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 dispatcher=None):
+        self.bot = bot
+        self.dispatcher = dispatcher or UpdateDispatcher(bot)
+        self.httpd = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.path = path
+        self.httpd.secret = secret
+        self.httpd.dispatcher = self.dispatcher
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def register(self, url=WEBHOOK_URL):
+        """Point Telegram at this server; skipped when no public URL is configured
+
+        url may be the public base URL or already end with WEBHOOK_PATH.
+        """
+        if not url:
+            logger.warning("WEBHOOK_URL is not set, not registering the webhook with Telegram")
+            return False
+        url = url.rstrip('/')
+        if not url.endswith(self.httpd.path):
+            url += self.httpd.path
+        return self.bot.set_webhook(
+            url=url,
+            secret_token=self.httpd.secret or None,
+            max_connections=min(max(self.dispatcher.workers, 1), 100)
+        )
+
+    def serve_forever(self):
+        # Handlers run on the dispatcher threads, not on telebot's own worker pool
+        self.bot.threaded = False
+        if not self.httpd.secret:
+            logger.warning("WEBHOOK_SECRET is not set, webhook requests are not authenticated")
+        self.dispatcher.start()
+        logger.info(f"Webhook server listening on {self.address[0]}:{self.address[1]}{self.httpd.path}")
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()